@@ -0,0 +1,842 @@
+"""
+Local benchmarks for the webhook Lambda (lambda_webhook.py).
+
+Every benchmark runs against in-process stub servers, so no AWS
+account or real webhook is needed.
+
+Usage:
+    python bench_webhook.py              # run every benchmark
+    python bench_webhook.py pagerduty    # run selected benchmarks
+    python bench_webhook.py profile [payload.json] [--top N] [--latency SECONDS]
+                                         # slowest spans for a replayed payload
+    python bench_webhook.py loadtest [--baseline FILE] [--save-baseline FILE]
+                                         # rule-shaped load test, optionally vs a baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+# Failed sends are measured, not spilled to /tmp for a later run
+os.environ.setdefault('SPILL_ENABLED', 'false')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import lambda_webhook  # noqa: E402
+from rules_lint import RULES_FILE, TEMPLATE_LABEL, load_alert_rules, series_labels  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark under its name without the bench_ prefix"""
+    BENCHMARKS[func.__name__[len('bench_'):]] = func
+    return func
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threaded server that ignores clients hanging up, e.g. on a read timeout"""
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """
+    Local HTTP sink standing in for a webhook endpoint.
+    Every POST sleeps for `latency` seconds; the first `throttle_first`
+    requests get a 429 with Retry-After so backpressure paths are exercised,
+    and a seeded `error_rate` fraction of the rest get a 503.
+    """
+
+    def __init__(self, latency=0.0, status=202, throttle_first=0, retry_after='0.05',
+                 error_rate=0.0, seed=0):
+        self.latency = latency
+        self.status = status
+        self.throttle_first = throttle_first
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.by_path = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    stub.by_path[self.path.rsplit('/', 1)[-1]] += 1
+                    throttle = stub.throttled < stub.throttle_first
+                    if throttle:
+                        stub.throttled += 1
+                    fail = not throttle and stub.random.random() < stub.error_rate
+                    if fail:
+                        stub.errors += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = b'{"status": "success"}'
+                self.send_response(429 if throttle else 503 if fail else stub.status)
+                if throttle:
+                    self.send_header('Retry-After', stub.retry_after)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = QuietHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v2/enqueue"
+
+
+class StubSNS:
+    """In-process stand-in for the boto3 SNS client"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.published = 0
+        self.errors = 0
+
+    def publish(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.random.random() < self.error_rate:
+            self.errors += 1
+            raise RuntimeError("stub SNS error")
+        self.published += 1
+        return {'MessageId': f'stub-{self.published}'}
+
+
+class StubContext:
+    """Lambda context stand-in whose invocation times out `timeout` seconds after creation"""
+
+    def __init__(self, timeout, clock=time.monotonic):
+        self.clock = clock
+        self.deadline = clock() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - self.clock()) * 1000))
+
+
+def configure_channels(**env):
+    """Set channel environment variables and drop cached channel state"""
+    os.environ.update({key: str(value) for key, value in env.items()})
+    for name in ('EMAIL', 'SLACK', 'DISCORD', 'TEAMS', 'PAGERDUTY'):
+        enabled = os.environ.get(f'{name}_ENABLED', 'false').lower() == 'true'
+        setattr(lambda_webhook, f'{name}_ENABLED', enabled)
+    lambda_webhook.get_channel_config.cache_clear()
+    lambda_webhook.rate_limiter = None
+    lambda_webhook.http_transport = None
+    lambda_webhook.outbound_queue = None
+
+
+def make_alerts(count, status='firing'):
+    """Build `count` distinct Alertmanager alerts"""
+    return [
+        {
+            'status': status,
+            'labels': {
+                'alertname': 'InstanceDown',
+                'severity': 'critical' if i % 3 == 0 else 'warning',
+                'instance': f"10.0.{i // 250}.{i % 250}:9100",
+                'job': 'node-exporter',
+            },
+            'annotations': {'summary': f"Instance {i} down"},
+            'startsAt': '2024-01-01T00:00:00Z',
+            'generatorURL': 'http://prometheus/graph',
+        }
+        for i in range(count)
+    ]
+
+
+def timed(func, *args):
+    """Run func with stdout silenced; return elapsed seconds"""
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    return time.perf_counter() - started
+
+
+@benchmark
+def bench_pagerduty(sizes=(10, 100, 1000), latency=0.02):
+    """Sequential vs bounded-concurrency PagerDuty submission"""
+    concurrency = lambda_webhook.get_channel_config('pagerduty')['max_concurrency']
+    print(f"PagerDuty submission, {latency * 1000:.0f}ms stub latency, "
+          f"concurrency={concurrency}")
+    print(f"{'alerts':>8} {'sequential/s':>14} {'concurrent/s':>14} {'speedup':>8}")
+
+    driver = lambda_webhook.get_driver('pagerduty')
+
+    def sequential(alerts):
+        for payload, _ in driver.render(alerts, ''):
+            driver.send(payload)
+
+    for size in sizes:
+        alerts = lambda_webhook.AlertBatch(make_alerts(size))
+        with StubServer(latency=latency) as stub:
+            configure_channels(PAGERDUTY_ENABLED='true', PAGERDUTY_EVENTS_URL=stub.url)
+            # Sequential timing is extrapolated from at most 100 alerts
+            sample = alerts[:100]
+            seq_rate = len(sample) / timed(sequential, sample)
+            par_rate = size / timed(driver.send_batch, alerts, '')
+            pool = lambda_webhook.http_transport.stats()
+        print(f"{size:>8} {seq_rate:>14.1f} {par_rate:>14.1f} {par_rate / seq_rate:>7.1f}x")
+    for host, counts in pool.items():
+        print(f"Connections to {host} in the last run: {counts['new_connections']} opened, "
+              f"{counts['reused_connections']} reused")
+
+    with StubServer(latency=latency, throttle_first=10) as stub:
+        configure_channels(PAGERDUTY_ENABLED='true', PAGERDUTY_EVENTS_URL=stub.url)
+        alerts = lambda_webhook.AlertBatch(make_alerts(100))
+        elapsed = timed(driver.send_batch, alerts, '')
+        print(f"100 alerts with 10 x 429 responses: {elapsed:.2f}s, "
+              f"{stub.requests} requests, all delivered")
+
+
+def legacy_channel_counts(alerts):
+    """The per-channel list comprehensions each formatter used to run"""
+    def count(predicate):
+        return len([a for a in alerts if predicate(a)])
+
+    def severity(a):
+        return a.get('labels', {}).get('severity')
+
+    counts = []
+    for _ in range(3):  # email subject, Discord and Teams summaries
+        counts.append((count(lambda a: severity(a) == 'critical'),
+                       count(lambda a: severity(a) == 'warning')))
+    for _ in range(2):  # Slack summary and email body
+        counts.append((count(lambda a: severity(a) == 'critical'),
+                       count(lambda a: severity(a) == 'warning'),
+                       count(lambda a: a.get('status') == 'firing'),
+                       count(lambda a: a.get('status') == 'resolved')))
+    return counts
+
+
+def batch_channel_counts(alerts):
+    """The same counts read from one AlertBatch"""
+    batch = lambda_webhook.AlertBatch(alerts)
+    return [(batch.critical_count, batch.warning_count,
+             batch.firing_count, batch.resolved_count) for _ in range(5)]
+
+
+def best_of(func, *args, repeat=5):
+    """Fastest of `repeat` runs, in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+@benchmark
+def bench_aggregation(size=10000):
+    """Per-channel rescans vs one single-pass AlertBatch"""
+    alerts = make_alerts(size)
+    alerts[::4] = make_alerts(len(alerts[::4]), status='resolved')
+    legacy = best_of(legacy_channel_counts, alerts)
+    batched = best_of(batch_channel_counts, alerts)
+    top = best_of(lambda: lambda_webhook.AlertBatch(alerts).top(5))
+    print(f"{size} alerts, counts for 5 channels")
+    print(f"  per-channel scans: {legacy * 1000:8.2f}ms")
+    print(f"  single AlertBatch: {batched * 1000:8.2f}ms ({legacy / batched:.1f}x)")
+    print(f"  AlertBatch + top(5): {top * 1000:6.2f}ms")
+
+
+def legacy_emoji(severity, status):
+    """The if/elif chain formerly run per alert"""
+    if status == 'resolved':
+        return '✅'
+    elif severity == 'critical':
+        return '🚨'
+    elif severity == 'warning':
+        return '⚠️'
+    elif severity == 'info':
+        return 'ℹ️'
+    return '🔔'
+
+
+def legacy_slack_color(severity, status):
+    if status == 'resolved':
+        return 'good'
+    elif severity == 'critical':
+        return 'danger'
+    elif severity == 'warning':
+        return 'warning'
+    return '#808080'
+
+
+def legacy_slack_payload(alert, config):
+    """Slack payload built from scratch per alert, then serialized"""
+    labels = alert.get('labels', {})
+    alert_name = labels.get('alertname', 'Unknown Alert')
+    severity = labels.get('severity', 'unknown')
+    status = alert.get('status', 'unknown')
+    return json.dumps({
+        "channel": config['channel'],
+        "username": config['username'],
+        "icon_emoji": ":warning:",
+        "attachments": [
+            {
+                "color": legacy_slack_color(severity, status),
+                "title": f"{legacy_emoji(severity, status)} {alert_name}",
+                "text": alert.get('annotations', {}).get('summary', 'No summary available'),
+                "fields": [
+                    {"title": "Status", "value": status.upper(), "short": True},
+                    {"title": "Severity", "value": severity.upper(), "short": True},
+                    {"title": "Instance", "value": labels.get('instance', 'unknown'), "short": True},
+                    {"title": "Job", "value": labels.get('job', 'unknown'), "short": True}
+                ],
+                "footer": "Prometheus Alert Manager",
+                "ts": int(time.time())
+            }
+        ]
+    })
+
+
+def legacy_pagerduty_payload(alert, config, external_url=''):
+    labels = alert.get('labels', {})
+    alert_name = labels.get('alertname', 'Unknown Alert')
+    severity = labels.get('severity', 'unknown')
+    return json.dumps({
+        "routing_key": config['integration_key'],
+        "event_action": "resolve" if alert.get('status') == "resolved" else "trigger",
+        "dedup_key": lambda_webhook.get_alert_fingerprint(alert),
+        "payload": {
+            "summary": f"{alert_name}: {alert.get('annotations', {}).get('summary', 'No summary available')}",
+            "severity": config['severity_map'].get(severity, severity),
+            "source": labels.get('instance', 'unknown'),
+            "component": labels.get('job', 'prometheus'),
+            "group": labels.get('alertname', 'prometheus'),
+            "class": "prometheus-alert",
+            "custom_details": {
+                "labels": labels,
+                "annotations": alert.get('annotations', {}),
+                "generator_url": alert.get('generatorURL', ''),
+                "external_url": external_url
+            }
+        }
+    })
+
+
+@benchmark
+def bench_templates(size=10000):
+    """Per-alert dict building + json.dumps vs compiled payload templates"""
+    alerts = make_alerts(size)
+    batch = lambda_webhook.AlertBatch(alerts)
+    slack = lambda_webhook.get_channel_config('slack')
+    pagerduty = lambda_webhook.get_channel_config('pagerduty')
+
+    # The compiled templates must produce byte-identical payloads
+    for alert, record in zip(alerts[:50], batch):
+        assert legacy_slack_payload(alert, slack) == lambda_webhook.render_slack_alert(record)
+        assert legacy_pagerduty_payload(alert, pagerduty) == \
+            lambda_webhook.render_pagerduty_event(record, '')
+
+    cases = [
+        ('slack', lambda: [legacy_slack_payload(a, slack) for a in alerts],
+         lambda: [lambda_webhook.render_slack_alert(r) for r in batch]),
+        ('pagerduty', lambda: [legacy_pagerduty_payload(a, pagerduty) for a in alerts],
+         lambda: [lambda_webhook.render_pagerduty_event(r, '') for r in batch]),
+    ]
+    print(f"{size} alerts rendered and serialized (output verified identical)")
+    print(f"{'channel':<10} {'legacy ms':>10} {'template ms':>12} {'speedup':>8}")
+    for name, legacy, compiled in cases:
+        legacy_time = best_of(legacy, repeat=3)
+        compiled_time = best_of(compiled, repeat=3)
+        print(f"{name:<10} {legacy_time * 1000:>10.1f} {compiled_time * 1000:>12.1f} "
+              f"{legacy_time / compiled_time:>7.1f}x")
+
+
+@benchmark
+def bench_json(size=10000):
+    """Event decoding and label fingerprints with the stdlib and orjson backends"""
+    import base64
+
+    alerts = make_alerts(size)
+    message = json.dumps({'alerts': alerts, 'externalURL': 'http://alertmanager'})
+    sns_event = {'Records': [{'EventSource': 'aws:sns', 'Sns': {'Message': message}}]}
+    url_event = {'body': base64.b64encode(message.encode()).decode(), 'isBase64Encoded': True}
+    unicode_alerts = [dict(alert, labels=dict(alert['labels'], team='équipe-π')) for alert in alerts[:50]]
+
+    backends = {'json': lambda_webhook.StdlibJSONCodec()}
+    try:
+        backends['orjson'] = lambda_webhook.OrjsonCodec()
+    except ImportError:
+        print("orjson is not installed; timing the stdlib backend only")
+
+    cases = [
+        ('SNS event decode', lambda: lambda_webhook.decode_event(sns_event)),
+        ('Function URL decode', lambda: lambda_webhook.decode_event(url_event)),
+        ('label fingerprints', lambda: [lambda_webhook.get_alert_fingerprint(a) for a in alerts]),
+    ]
+    checks = cases + [
+        ('unicode fingerprints', lambda: [lambda_webhook.get_alert_fingerprint(a) for a in unicode_alerts]),
+    ]
+
+    timings = {}
+    outputs = {}
+    try:
+        for backend, codec in backends.items():
+            lambda_webhook.json_codec = codec
+            outputs[backend] = [check() for _, check in checks]
+            timings[backend] = [best_of(case, repeat=3) for _, case in cases]
+    finally:
+        lambda_webhook.json_codec = None
+    # Every backend must decode and fingerprint exactly like stdlib
+    for backend, output in outputs.items():
+        assert output == outputs['json'], f"{backend} output differs from stdlib"
+
+    print(f"{size} alerts, {len(message) / 1e6:.1f} MB payload (output verified identical)")
+    print(f"{'case':<22}" + "".join(f"{name + ' ms':>12}" for name in backends) +
+          (f"{'speedup':>9}" if len(backends) > 1 else ""))
+    for index, (name, _) in enumerate(cases):
+        row = [timings[backend][index] for backend in backends]
+        speedup = f"{row[0] / row[-1]:>8.1f}x" if len(row) > 1 else ""
+        print(f"{name:<22}" + "".join(f"{t * 1000:>12.1f}" for t in row) + speedup)
+
+
+def routing_rules(count, seed=0):
+    """Mixed routing config: team/service routes plus a few catch-all regex rules"""
+    rng = random.Random(seed)
+    channels = ['email', 'slack', 'discord', 'teams', 'pagerduty']
+    routes = [{'matchers': ['alertname=~"Watchdog|InfoInhibitor"'], 'channels': [], 'stop': True}]
+    routes += [
+        {'matchers': [f'alertname=~".*{word}.*"', 'env!="staging"'], 'channels': ['email']}
+        for word in ('Disk', 'Memory', 'Latency', 'Certificate')
+    ]
+    for index in range(count - len(routes)):
+        kind = index % 4
+        if kind == 0:
+            matchers = [f'team="team-{index}"', 'severity="critical"']
+        elif kind == 1:
+            matchers = [f'service=~"svc-{index}|svc-{index}-canary"', 'env!="staging"']
+        elif kind == 2:
+            matchers = [f'team="team-{index}"', 'alertname=~"Disk.*|Instance.*"']
+        else:
+            matchers = [f'cluster="cluster-{index}"', f'namespace!~"kube-.*|test-{index}"']
+        routes.append({'matchers': matchers, 'channels': rng.sample(channels, 2), 'stop': index % 7 == 0})
+    return {'routes': routes, 'default': ['slack']}
+
+
+def routing_alerts(size, rule_count, seed=0):
+    rng = random.Random(seed)
+    names = ['InstanceDown', 'DiskFull', 'HighMemory', 'HighLatency', 'Watchdog', 'CertificateExpiry']
+    return lambda_webhook.AlertBatch([
+        {
+            'status': 'firing',
+            'labels': {
+                'alertname': rng.choice(names),
+                'severity': rng.choice(['critical', 'warning']),
+                'team': f"team-{rng.randrange(rule_count)}",
+                'service': f"svc-{rng.randrange(rule_count)}",
+                'cluster': f"cluster-{rng.randrange(rule_count)}",
+                'namespace': rng.choice(['default', 'kube-system', 'payments']),
+                'env': rng.choice(['prod', 'staging']),
+                'instance': f"10.0.{i // 250}.{i % 250}:9100",
+            },
+        }
+        for i in range(size)
+    ])
+
+
+def linear_channels_for(router, labels):
+    """Reference router: check every rule in turn"""
+    channels = []
+    matched = False
+    for rule in router.rules:
+        if all(matcher.matches(labels) for matcher in rule.matchers):
+            matched = True
+            channels.extend(channel for channel in rule.channels if channel not in channels)
+            if rule.stop:
+                break
+    return channels if matched else router.default_channels
+
+
+@benchmark
+def bench_routing(rule_counts=(100, 1000, 5000), size=5000):
+    """Per-alert routing cost with the label index against a linear rule scan"""
+    print(f"{size} alerts per run (routes verified identical to a linear scan)")
+    print(f"{'rules':>6}{'compile ms':>12}{'candidates':>12}{'index us':>10}{'linear us':>11}{'speedup':>9}")
+    for rule_count in rule_counts:
+        config = routing_rules(rule_count)
+        started = time.perf_counter()
+        router = lambda_webhook.AlertRouter.from_config(config)
+        compile_ms = (time.perf_counter() - started) * 1000
+        alerts = routing_alerts(size, rule_count)
+
+        indexed = [router.channels_for(alert.labels) for alert in alerts]
+        linear = [linear_channels_for(router, alert.labels) for alert in alerts]
+        assert indexed == linear, f"indexed routing differs from linear scan with {rule_count} rules"
+        candidates = sum(len(router.candidates(alert.labels)) for alert in alerts) / size
+
+        index_time = best_of(lambda: [router.channels_for(alert.labels) for alert in alerts], repeat=3)
+        linear_time = best_of(lambda: [linear_channels_for(router, alert.labels) for alert in alerts], repeat=1)
+        print(f"{rule_count:>6}{compile_ms:>12.1f}{candidates:>12.1f}{index_time / size * 1e6:>10.1f}"
+              f"{linear_time / size * 1e6:>11.1f}{linear_time / index_time:>8.0f}x")
+
+
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import lambda_webhook
+imported = time.perf_counter()
+with open(sys.argv[1]) as f:
+    event = json.load(f)
+lambda_webhook.handler(event, None)
+invoked = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_invoke_ms': (invoked - imported) * 1000,
+    'boto3_loaded': 'boto3' in sys.modules,
+}), file=sys.stderr)
+"""
+
+
+def measure_startup(env, event_path, runs):
+    """Median import and first-invoke latency over fresh interpreters"""
+    samples = []
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE, event_path],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, **env),
+            capture_output=True, text=True, check=True
+        )
+        samples.append(json.loads(proc.stderr.strip().splitlines()[-1]))
+    samples.sort(key=lambda sample: sample['import_ms'] + sample['first_invoke_ms'])
+    return samples[len(samples) // 2]
+
+
+@benchmark
+def bench_startup(runs=5):
+    """Cold-start cost: module import plus first handler() call"""
+    import tempfile
+
+    with StubServer() as stub, tempfile.NamedTemporaryFile('w', suffix='.json') as event:
+        json.dump({'alerts': make_alerts(5)}, event)
+        event.flush()
+        base_env = {'AWS_DEFAULT_REGION': 'us-east-1', 'DEDUP_ENABLED': 'false'}
+        scenarios = {
+            'no channels': {},
+            'slack only': {'SLACK_ENABLED': 'true', 'SLACK_WEBHOOK_URL': stub.url},
+            # SNS calls go to the stub (and fail); this measures boto3 setup
+            'slack + email': {'SLACK_ENABLED': 'true', 'SLACK_WEBHOOK_URL': stub.url,
+                              'EMAIL_ENABLED': 'true',
+                              'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:000000000000:bench',
+                              'AWS_ENDPOINT_URL_SNS': stub.url,
+                              'AWS_ACCESS_KEY_ID': 'bench', 'AWS_SECRET_ACCESS_KEY': 'bench'},
+        }
+        print(f"Median of {runs} fresh interpreters")
+        print(f"{'scenario':<16} {'import ms':>10} {'first invoke ms':>16} {'boto3 loaded':>13}")
+        for name, env in scenarios.items():
+            sample = measure_startup(dict(base_env, **env), event.name, runs)
+            print(f"{name:<16} {sample['import_ms']:>10.1f} {sample['first_invoke_ms']:>16.1f} "
+                  f"{str(sample['boto3_loaded']):>13}")
+
+
+def profile(argv):
+    """Replay a payload through handler() against local stubs and list the slowest spans"""
+    parser = argparse.ArgumentParser(prog='bench_webhook.py profile', description=profile.__doc__)
+    parser.add_argument('payload', nargs='?',
+                        help='Alertmanager payload or Lambda event as JSON (default: 100 synthetic alerts)')
+    parser.add_argument('--top', type=int, default=10, help='number of spans to list (default: 10)')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='stub webhook and SNS latency in seconds (default: 0.02)')
+    args = parser.parse_args(argv)
+
+    if args.payload:
+        with open(args.payload) as f:
+            event = json.load(f)
+    else:
+        event = {'alerts': make_alerts(100)}
+
+    with StubServer(latency=args.latency) as stub:
+        configure_channels(
+            EMAIL_ENABLED='true', SNS_TOPIC_ARN='arn:aws:sns:us-east-1:000000000000:profile',
+            SLACK_ENABLED='true', SLACK_WEBHOOK_URL=f'{stub.url}/slack',
+            DISCORD_ENABLED='true', DISCORD_WEBHOOK_URL=f'{stub.url}/discord',
+            TEAMS_ENABLED='true', TEAMS_WEBHOOK_URL=f'{stub.url}/teams',
+            PAGERDUTY_ENABLED='true', PAGERDUTY_INTEGRATION_KEY='profile',
+            PAGERDUTY_EVENTS_URL=f'{stub.url}/pagerduty'
+        )
+        lambda_webhook.sns_client = StubSNS(args.latency)
+        lambda_webhook.DEDUP_ENABLED = False
+        tracer = lambda_webhook.tracer
+        tracer.sample_rate = 1.0
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = lambda_webhook.handler(event, None)
+
+    body = json.loads(response['body'])
+    print(f"Replayed {body.get('processed_alerts', 0)} alerts: {len(tracer.spans)} spans, "
+          f"{stub.requests} webhook requests, {args.latency * 1000:g}ms stub latency")
+    print(f"{'span':<12} {'channel':<10} {'start ms':>10} {'duration ms':>12}")
+    for span in tracer.slowest(args.top):
+        print(f"{span['name']:<12} {span['attributes'].get('channel', ''):<10} "
+              f"{span['start_ms']:>10.1f} {span['duration_ms']:>12.1f}")
+    return 0
+
+
+TEMPLATE_VALUE = re.compile(r'{{\s*\$value\s*}}')
+
+
+class RulePayloadGenerator:
+    """
+    Seeded synthetic Alertmanager payloads shaped by alerting rules.
+    Alertmanager groups by alertname, so each payload holds alerts of
+    one rule: one per distinct value of the rule's grouping labels
+    across `instances` targets spread over `jobs` jobs. Group sizes are
+    skewed small with occasional storms; annotations are rendered from
+    the rule's templates.
+    """
+
+    def __init__(self, rules, instances=50, jobs=5, resolve_rate=0.2, seed=1):
+        self.random = random.Random(seed)
+        self.resolve_rate = resolve_rate
+        targets = [
+            {'instance': f"10.0.{i // 250}.{i % 250}:9100", 'job': f"job-{i % jobs}"}
+            for i in range(instances)
+        ]
+        self.rules = []
+        for rule in rules:
+            names = series_labels(rule)
+            series = {tuple((name, target.get(name, f"{name}-0")) for name in names) for target in targets}
+            self.rules.append((rule, sorted(series)))
+
+    def payload(self):
+        rule, series = self.random.choice(self.rules)
+        count = max(1, int(len(series) * self.random.random() ** 3))
+        alerts = [self.alert(rule, dict(labels)) for labels in self.random.sample(series, count)]
+        return {
+            'version': '4',
+            'groupKey': f'{{}}:{{alertname="{rule["alert"]}"}}',
+            'status': 'firing' if any(a['status'] == 'firing' for a in alerts) else 'resolved',
+            'receiver': 'sns-webhook',
+            'groupLabels': {'alertname': rule['alert']},
+            'commonLabels': dict(rule.get('labels', {}), alertname=rule['alert']),
+            'externalURL': 'http://alertmanager.local',
+            'alerts': alerts,
+        }
+
+    def alert(self, rule, series):
+        labels = dict(series, **rule.get('labels', {}), alertname=rule['alert'])
+        value = f"{self.random.uniform(0, 100):.2f}"
+
+        def render(text):
+            text = TEMPLATE_LABEL.sub(lambda match: labels.get(match.group(1), ''), text)
+            return TEMPLATE_VALUE.sub(value, text)
+
+        resolved = self.random.random() < self.resolve_rate
+        return {
+            'status': 'resolved' if resolved else 'firing',
+            'labels': labels,
+            'annotations': {name: render(text) for name, text in rule.get('annotations', {}).items()},
+            'startsAt': '2024-01-01T00:00:00Z',
+            'endsAt': '2024-01-01T00:10:00Z' if resolved else '0001-01-01T00:00:00Z',
+            'generatorURL': f"http://prometheus/graph?g0.expr={rule['alert']}",
+        }
+
+    def sns_event(self):
+        """The payload as delivered to the Lambda by the Alertmanager SNS receiver"""
+        return {'Records': [{
+            'EventSource': 'aws:sns',
+            'Sns': {'Type': 'Notification', 'Subject': 'Prometheus Alert',
+                    'Message': json.dumps(self.payload())},
+        }]}
+
+
+LOADTEST_SCENARIOS = {
+    'steady': {'latency': 0.02, 'error_rate': 0.0},
+    'slow-sinks': {'latency': 0.1, 'error_rate': 0.0},
+    'flaky-sinks': {'latency': 0.02, 'error_rate': 0.05},
+    'deadline': {'latency': 0.1, 'error_rate': 0.0, 'timeout': 2.0},
+}
+
+# Metric -> True if higher is better; compared against the baseline
+LOADTEST_COMPARED = {'alerts_per_s': True, 'p50_ms': False, 'p99_ms': False, 'requests_total': False}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def run_loadtest_scenario(events, latency, error_rate, seed, timeout=None):
+    """
+    Run events through handler() with every channel on local stubs.
+    With a timeout each invocation gets a StubContext with that much time.
+    """
+    with StubServer(latency=latency, error_rate=error_rate, seed=seed) as stub:
+        configure_channels(
+            EMAIL_ENABLED='true', SNS_TOPIC_ARN='arn:aws:sns:us-east-1:000000000000:loadtest',
+            SLACK_ENABLED='true', SLACK_WEBHOOK_URL=f'{stub.url}/slack', SLACK_RATE_LIMIT='0',
+            DISCORD_ENABLED='true', DISCORD_WEBHOOK_URL=f'{stub.url}/discord', DISCORD_RATE_LIMIT='0',
+            TEAMS_ENABLED='true', TEAMS_WEBHOOK_URL=f'{stub.url}/teams', TEAMS_RATE_LIMIT='0',
+            PAGERDUTY_ENABLED='true', PAGERDUTY_INTEGRATION_KEY='loadtest',
+            PAGERDUTY_EVENTS_URL=f'{stub.url}/pagerduty'
+        )
+        sns = StubSNS(latency, error_rate, seed)
+        lambda_webhook.sns_client = sns
+        lambda_webhook.dedup_cache = None
+
+        latencies = []
+        alerts = 0
+        channel_errors = 0
+        deferred = 0
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for event in events:
+                invoked = time.perf_counter()
+                response = lambda_webhook.handler(event, StubContext(timeout) if timeout else None)
+                latencies.append((time.perf_counter() - invoked) * 1000)
+                body = json.loads(response['body'])
+                alerts += body.get('processed_alerts', 0)
+                channel_errors += len(body.get('channel_errors', {}))
+                deferred += sum(body.get('deadline', {}).get('deferred', {}).values())
+        elapsed = time.perf_counter() - started
+
+    requests = dict(sorted(stub.by_path.items()), sns=sns.published + sns.errors)
+    return {
+        'invocations': len(events),
+        'alerts': alerts,
+        'alerts_per_s': round(alerts / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5), 1),
+        'p99_ms': round(percentile(latencies, 0.99), 1),
+        'max_ms': round(max(latencies), 1),
+        'requests': requests,
+        'requests_total': sum(requests.values()),
+        'sink_errors': stub.errors + sns.errors,
+        'channel_errors': channel_errors,
+        'deferred': deferred,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Print each compared metric against the baseline; return the regressions"""
+    regressions = []
+    print(f"{'scenario':<12} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            print(f"{name:<12} (not in baseline)")
+            continue
+        for metric, higher_is_better in LOADTEST_COMPARED.items():
+            before, after = previous[metric], result[metric]
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = ' !' if worse > tolerance else ''
+            if flag:
+                regressions.append(f"{name}.{metric}")
+            print(f"{name:<12} {metric:<15} {before:>10} {after:>10} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def loadtest(argv):
+    """Replay rule-shaped payloads through handler() and report throughput and latency"""
+    parser = argparse.ArgumentParser(prog='bench_webhook.py loadtest', description=loadtest.__doc__)
+    parser.add_argument('--scenario', action='append', choices=list(LOADTEST_SCENARIOS),
+                        help='scenario to run; repeatable (default: all)')
+    parser.add_argument('--invocations', type=int, default=40, help='invocations per scenario (default: 40)')
+    parser.add_argument('--instances', type=int, default=50, help='scrape targets behind the rules (default: 50)')
+    parser.add_argument('--jobs', type=int, default=5, help='jobs the targets are spread over (default: 5)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for payloads and sink errors')
+    parser.add_argument('--rules', default=RULES_FILE, help='Prometheus rules file (default: prometheus-rules.yml)')
+    parser.add_argument('--baseline', help='compare against results saved with --save-baseline')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='relative change counted as a regression (default: 0.15)')
+    parser.add_argument('--save-baseline', help='write the results as a baseline JSON file')
+    args = parser.parse_args(argv)
+
+    params = {key: getattr(args, key) for key in ('invocations', 'instances', 'jobs', 'seed')}
+    rules = load_alert_rules(args.rules)
+    generator = RulePayloadGenerator(rules, args.instances, args.jobs, seed=args.seed)
+    events = [generator.sns_event() for _ in range(args.invocations)]
+    sizes = [len(json.loads(event['Records'][0]['Sns']['Message'])['alerts']) for event in events]
+    print(f"{len(rules)} alerting rules, {len(events)} payloads per scenario, "
+          f"{min(sizes)}-{max(sizes)} alerts each (median {percentile(sizes, 0.5)})")
+
+    results = {}
+    print(f"{'scenario':<12} {'alerts/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'requests':>9} "
+          f"{'sink errors':>12} {'channel errors':>15}")
+    for name in args.scenario or LOADTEST_SCENARIOS:
+        result = run_loadtest_scenario(events, seed=args.seed, **LOADTEST_SCENARIOS[name])
+        results[name] = result
+        print(f"{name:<12} {result['alerts_per_s']:>9} {result['p50_ms']:>8} {result['p99_ms']:>8} "
+              f"{result['requests_total']:>9} {result['sink_errors']:>12} {result['channel_errors']:>15}")
+        print(f"{'':<12} requests: " + ", ".join(f"{k}={v}" for k, v in result['requests'].items()) +
+              (f"; {result['deferred']} past their deadline" if result['deferred'] else ""))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params': params, 'scenarios': results}, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"Warning: baseline was recorded with {baseline.get('params')}, this run used {params}")
+        print()
+        regressions = compare_to_baseline(results, baseline.get('scenarios', {}), args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+COMMANDS = {'profile': profile, 'loadtest': loadtest}
+
+
+def main(argv):
+    if argv[:1] and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+    names = argv or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)}. "
+              f"Available: {', '.join(BENCHMARKS)}")
+        return 2
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
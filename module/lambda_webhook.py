@@ -1,445 +1,2820 @@
+import abc
+import base64
+import contextlib
+import functools
+import hashlib
+import heapq
+import io
+import itertools
 import json
-import boto3
 import os
-import urllib3
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait as wait_futures
 from datetime import datetime
+from json.encoder import encode_basestring_ascii
 
-# Initialize clients
-sns = boto3.client('sns')
-http = urllib3.PoolManager()
+# boto3, urllib3 and email.utils are imported on first use (see get_sns_client and
+# get_http_transport) so cold starts only pay for the channels that are enabled
 
-# Environment variables
-SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN', '')
+# Channel switches; the rest of each channel's settings is read by
+# get_channel_config() the first time that channel is used
 EMAIL_ENABLED = os.environ.get('EMAIL_ENABLED', 'false').lower() == 'true'
-
 SLACK_ENABLED = os.environ.get('SLACK_ENABLED', 'false').lower() == 'true'
-SLACK_WEBHOOK_URL = os.environ.get('SLACK_WEBHOOK_URL', '')
-SLACK_CHANNEL = os.environ.get('SLACK_CHANNEL', '#alerts')
-SLACK_USERNAME = os.environ.get('SLACK_USERNAME', 'Prometheus')
-
 DISCORD_ENABLED = os.environ.get('DISCORD_ENABLED', 'false').lower() == 'true'
-DISCORD_WEBHOOK_URL = os.environ.get('DISCORD_WEBHOOK_URL', '')
-DISCORD_USERNAME = os.environ.get('DISCORD_USERNAME', 'Prometheus')
-
 TEAMS_ENABLED = os.environ.get('TEAMS_ENABLED', 'false').lower() == 'true'
-TEAMS_WEBHOOK_URL = os.environ.get('TEAMS_WEBHOOK_URL', '')
+PAGERDUTY_ENABLED = os.environ.get('PAGERDUTY_ENABLED', 'false').lower() == 'true'
+
+# Email size limits (SNS rejects messages over 256 KB)
+SNS_MAX_MESSAGE_BYTES = int(os.environ.get('SNS_MAX_MESSAGE_BYTES', '262144'))
+EMAIL_OVERFLOW_MODE = os.environ.get('EMAIL_OVERFLOW_MODE', 'truncate').lower()
+
+# Dispatch configuration
+CHANNEL_TIMEOUT_SECONDS = float(os.environ.get('CHANNEL_TIMEOUT_SECONDS', '25'))
+# Extra time given to timed-out channels to finish before the handler returns
+CHANNEL_SHUTDOWN_GRACE_SECONDS = float(os.environ.get('CHANNEL_SHUTDOWN_GRACE_SECONDS', '2'))
+
+# Deadline budgeting: time held back from the Lambda timeout to return the
+# response, and the share of the rest each channel priority may use
+DEADLINE_RESERVE_SECONDS = float(os.environ.get('DEADLINE_RESERVE_SECONDS', '1.5'))
+PRIORITY_SHARES = {'high': 1.0, 'normal': 0.8, 'low': 0.5}
+
+# HTTP transport configuration (connections are kept alive across warm invocations)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '10'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '2'))
+
+# HTTP retry configuration (shared by every webhook channel)
+HTTP_MAX_ATTEMPTS = int(os.environ.get('HTTP_MAX_ATTEMPTS', '3'))
+HTTP_RETRY_BASE_DELAY = float(os.environ.get('HTTP_RETRY_BASE_DELAY', '0.5'))
+HTTP_RETRY_MAX_DELAY = float(os.environ.get('HTTP_RETRY_MAX_DELAY', '8'))
+HTTP_RETRY_BUDGET_SECONDS = float(os.environ.get('HTTP_RETRY_BUDGET_SECONDS', '15'))
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Alerts held per webhook while it is over its rate limit
+COALESCE_MAX_ALERTS = int(os.environ.get('COALESCE_MAX_ALERTS', '500'))
+
+# Deduplication configuration
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_TTL_SECONDS = float(os.environ.get('DEDUP_TTL_SECONDS', '3600'))
+DEDUP_MAX_ENTRIES = int(os.environ.get('DEDUP_MAX_ENTRIES', '10000'))
+DEDUP_TABLE_NAME = os.environ.get('DEDUP_TABLE_NAME', '')
+DEDUP_STATE_FILE = os.environ.get('DEDUP_STATE_FILE', '')
+DEDUP_STATE_TTL_SECONDS = float(os.environ.get('DEDUP_STATE_TTL_SECONDS', '86400'))
+
+# Outbound spill queue for deliveries that fail (SQS FIFO queue if set, else local files)
+SPILL_ENABLED = os.environ.get('SPILL_ENABLED', 'true').lower() == 'true'
+SPILL_QUEUE_URL = os.environ.get('SPILL_QUEUE_URL', '')
+SPILL_DIR = os.environ.get('SPILL_DIR', '/tmp/alert-spill')
+SPILL_MAX_MESSAGES = int(os.environ.get('SPILL_MAX_MESSAGES', '1000'))
+SPILL_DRAIN_MAX = int(os.environ.get('SPILL_DRAIN_MAX', '50'))
+SPILL_MAX_REPLAYS = int(os.environ.get('SPILL_MAX_REPLAYS', '5'))
+
+# CloudWatch Embedded Metric Format output
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'PrometheusAlertWebhook')
+
+# Fraction of invocations whose spans are written to the log (0 disables tracing)
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+
+# Digest windows (per channel, <CHANNEL>_DIGEST_WINDOW seconds) are kept here;
+# a DynamoDB table keyed on `channel` if set, else local files
+DIGEST_TABLE_NAME = os.environ.get('DIGEST_TABLE_NAME', '')
+DIGEST_DIR = os.environ.get('DIGEST_DIR', '/tmp/alert-digest')
+
+# Routing rules as JSON, inline (ROUTING_RULES) or in a file shipped with the function
+ROUTING_RULES_FILE = os.environ.get('ROUTING_RULES_FILE', '')
+
+# JSON backend: auto (orjson when installed), orjson or json
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto').lower()
+
+# Survive across warm invocations of the same container
+sns_client = None  # a stand-in used in place of the boto3 clients when set
+sns_clients = {}
+http_transport = None
+client_lock = threading.Lock()
+dedup_cache = None
+rate_limiter = None
+coalesced_alerts = {}
+outbound_queue = None
+json_codec = None
+digest_drivers = {}
+
+@functools.lru_cache(maxsize=None)
+def get_channel_config(name):
+    """
+    Read one channel's settings from the environment on first use.
+    Rate limits are "<requests per second>:<burst>"; "0" disables them.
+    Digest windows are in seconds; "0" sends every batch immediately.
+    Transitions ("new,resolved") limit a channel to those alert
+    transitions; empty means every alert. Priorities (high, normal,
+    low) set how much of the invocation's time a channel may use.
+    """
+    env = os.environ.get
+    if name == 'email':
+        return {
+            'topic_arn': env('SNS_TOPIC_ARN', ''),
+            'digest_window': float(env('EMAIL_DIGEST_WINDOW', '0')),
+            'transitions': parse_transitions(env('EMAIL_TRANSITIONS', '')),
+            'priority': parse_priority(env('EMAIL_PRIORITY', 'low'))
+        }
+    if name == 'slack':
+        return {
+            'webhook_url': env('SLACK_WEBHOOK_URL', ''),
+            'channel': env('SLACK_CHANNEL', '#alerts'),
+            'username': env('SLACK_USERNAME', 'Prometheus'),
+            'rate_limit': parse_rate_limit(env('SLACK_RATE_LIMIT', '1:3')),
+            'digest_window': float(env('SLACK_DIGEST_WINDOW', '0')),
+            'transitions': parse_transitions(env('SLACK_TRANSITIONS', '')),
+            'priority': parse_priority(env('SLACK_PRIORITY', 'normal'))
+        }
+    if name == 'discord':
+        return {
+            'webhook_url': env('DISCORD_WEBHOOK_URL', ''),
+            'username': env('DISCORD_USERNAME', 'Prometheus'),
+            'rate_limit': parse_rate_limit(env('DISCORD_RATE_LIMIT', '2.5:5')),
+            'digest_window': float(env('DISCORD_DIGEST_WINDOW', '0')),
+            'transitions': parse_transitions(env('DISCORD_TRANSITIONS', '')),
+            'priority': parse_priority(env('DISCORD_PRIORITY', 'normal'))
+        }
+    if name == 'teams':
+        return {
+            'webhook_url': env('TEAMS_WEBHOOK_URL', ''),
+            'rate_limit': parse_rate_limit(env('TEAMS_RATE_LIMIT', '4:4')),
+            'digest_window': float(env('TEAMS_DIGEST_WINDOW', '0')),
+            'transitions': parse_transitions(env('TEAMS_TRANSITIONS', '')),
+            'priority': parse_priority(env('TEAMS_PRIORITY', 'normal'))
+        }
+    if name == 'pagerduty':
+        return {
+            'integration_key': env('PAGERDUTY_INTEGRATION_KEY', ''),
+            'severity_map': json.loads(env('PAGERDUTY_SEVERITY_MAP', '{}')),
+            'events_url': env('PAGERDUTY_EVENTS_URL', 'https://events.pagerduty.com/v2/enqueue'),
+            'max_concurrency': int(env('PAGERDUTY_MAX_CONCURRENCY', '8')),
+            'max_attempts': int(env('PAGERDUTY_MAX_ATTEMPTS', '3')),
+            'transitions': parse_transitions(env('PAGERDUTY_TRANSITIONS', '')),
+            'priority': parse_priority(env('PAGERDUTY_PRIORITY', 'high'))
+        }
+    raise ValueError(f"Unknown channel: {name}")
+
+def get_sns_client(time_left=float('inf')):
+    """
+    The SNS client for a publish that must finish within time_left
+    seconds; boto3 is imported here. botocore fixes timeouts and
+    retries per client, so clients are kept per (read timeout,
+    attempts) pair. An attempt may take up to HTTP_READ_TIMEOUT (whole
+    seconds, at least 1) and botocore retries only as often as the
+    time left allows, its backoff included.
+    """
+    if sns_client is not None:
+        return sns_client
+    read_timeout, attempts = HTTP_READ_TIMEOUT, HTTP_MAX_ATTEMPTS
+    if time_left < float('inf'):
+        read_timeout = float(max(1, min(int(HTTP_READ_TIMEOUT), int(time_left))))
+        attempts = 1
+        # Standard-mode retries back off up to 1s, 2s, 4s, ... before each retry
+        while attempts < HTTP_MAX_ATTEMPTS and (attempts + 1) * read_timeout + 2 ** attempts - 1 <= time_left:
+            attempts += 1
+    key = (read_timeout, attempts)
+    if key not in sns_clients:
+        with client_lock:
+            if key not in sns_clients:
+                import boto3
+                from botocore.config import Config
+                
+                sns_clients[key] = boto3.client('sns', config=Config(
+                    connect_timeout=min(HTTP_CONNECT_TIMEOUT, read_timeout),
+                    read_timeout=read_timeout,
+                    retries={'total_max_attempts': attempts, 'mode': 'standard'}
+                ))
+    return sns_clients[key]
+
+def get_http_transport():
+    """
+    Create the shared HTTP transport on first use. PagerDuty's host gets
+    one pooled connection per concurrent worker; other hosts get
+    HTTP_POOL_MAXSIZE.
+    """
+    global http_transport
+    if http_transport is None:
+        with client_lock:
+            if http_transport is None:
+                transport = HTTPTransport(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_MAXSIZE)
+                if PAGERDUTY_ENABLED:
+                    config = get_channel_config('pagerduty')
+                    transport.set_pool_size(config['events_url'], config['max_concurrency'])
+                http_transport = transport
+    return http_transport
+
+class HTTPTransport:
+    """
+    Keep-alive connection pools per destination host with connect and
+    read timeouts. Pools live as long as the warm container, and
+    reused vs newly opened connections are counted per host.
+    """
+    
+    def __init__(self, connect_timeout, read_timeout, default_pool_size=2):
+        import urllib3
+        
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.default_pool_size = default_pool_size
+        self.pool_sizes = {}
+        self.manager = urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=False
+        )
+    
+    def set_pool_size(self, url, size):
+        """Size the pool for url's host, e.g. to its number of concurrent senders"""
+        host = get_url_host(url)
+        self.pool_sizes[host] = max(size, self.pool_sizes.get(host, 1))
+    
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """POST through the host's pool; timeout (seconds) caps the connect and read timeouts"""
+        import urllib3
+        
+        size = self.pool_sizes.get(get_url_host(url), self.default_pool_size)
+        pool = self.manager.connection_from_url(url, pool_kwargs={'maxsize': size})
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = urllib3.Timeout(
+                connect=min(self.connect_timeout, timeout),
+                read=min(self.read_timeout, timeout)
+            )
+        # The pool is already bound to the host, so send an origin-form
+        # request line (path and query) rather than the absolute URL
+        path = urllib3.util.parse_url(url).request_uri
+        return pool.urlopen(method, path, body=body, headers=headers, retries=False, redirect=False, **kwargs)
+    
+    def stats(self):
+        """Per-host counts of requests, new connections and reused connections"""
+        stats = {}
+        for key in list(self.manager.pools.keys()):
+            pool = self.manager.pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.host}:{pool.port}" if pool.port else pool.host
+            entry = stats.setdefault(host, {'requests': 0, 'new_connections': 0, 'reused_connections': 0})
+            entry['requests'] += pool.num_requests
+            entry['new_connections'] += pool.num_connections
+            entry['reused_connections'] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+
+def get_url_host(url):
+    """host[:port] part of a URL"""
+    return url.split('://', 1)[-1].split('/', 1)[0].rsplit('@', 1)[-1].lower()
+
+def get_json_codec():
+    """Pick the JSON backend on first use: orjson if installed (JSON_BACKEND=auto), else stdlib"""
+    global json_codec
+    if json_codec is None:
+        codec = StdlibJSONCodec()
+        if JSON_BACKEND in ('auto', 'orjson'):
+            try:
+                codec = OrjsonCodec()
+            except ImportError:
+                if JSON_BACKEND == 'orjson':
+                    raise
+        json_codec = codec
+    return json_codec
+
+class StdlibJSONCodec:
+    """
+    JSON through the standard library. This is the reference format:
+    other backends must produce byte-identical output or defer to it.
+    """
+    name = 'json'
+    
+    def loads(self, data):
+        return json.loads(data)
+    
+    def dumps_bytes(self, value):
+        """The wire format (json.dumps defaults, ASCII-only) as bytes"""
+        return json.dumps(value).encode('ascii')
+    
+    def dumps_sorted(self, value):
+        """Compact JSON with sorted keys, as bytes; used for fingerprints"""
+        return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+class OrjsonCodec(StdlibJSONCodec):
+    """
+    orjson for decoding and compact encoding. orjson cannot emit the
+    spaced, ASCII-escaped wire format, so dumps_bytes stays on stdlib,
+    and compact output that is not pure ASCII (where orjson writes
+    UTF-8 and json escapes) is redone by stdlib to stay identical.
+    """
+    name = 'orjson'
+    
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.loads = orjson.loads
+    
+    def dumps_sorted(self, value):
+        try:
+            data = self.orjson.dumps(value, option=self.orjson.OPT_SORT_KEYS)
+        except TypeError:
+            return super().dumps_sorted(value)
+        return data if data.isascii() else super().dumps_sorted(value)
+
+class MetricsRecorder:
+    """
+    Buffers one invocation's metrics and writes them as CloudWatch
+    Embedded Metric Format log lines on flush(), so CloudWatch extracts
+    them from the function's logs without any PutMetricData calls.
+    Metrics recorded with a channel get a Channel dimension; repeated
+    values of a metric form a distribution (e.g. send latency).
+    """
+    
+    MAX_VALUES = 100  # EMF accepts at most 100 values per metric per line
+    
+    def __init__(self, namespace, enabled=True, clock=time.time):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.values = {}
+        self.units = {}
+    
+    def record(self, name, value, unit='Count', channel=None):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values.setdefault(channel, {}).setdefault(name, []).append(value)
+            self.units[name] = unit
+    
+    def flush(self, write=print):
+        """Write everything recorded since the last flush; returns the lines"""
+        with self.lock:
+            values, self.values = self.values, {}
+        timestamp = int(self.clock() * 1000)
+        lines = []
+        for channel, metrics in values.items():
+            longest = max(len(series) for series in metrics.values())
+            for start in range(0, longest, self.MAX_VALUES):
+                chunk = {
+                    name: series[start:start + self.MAX_VALUES]
+                    for name, series in metrics.items() if len(series) > start
+                }
+                document = {
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': [['Channel']] if channel else [[]],
+                            'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in chunk]
+                        }]
+                    }
+                }
+                if channel:
+                    document['Channel'] = channel
+                for name, series in chunk.items():
+                    document[name] = series[0] if len(series) == 1 else series
+                lines.append(json.dumps(document))
+        if lines:
+            write('\n'.join(lines))
+        return lines
+
+# Flushed at the end of every invocation
+metrics = MetricsRecorder(METRICS_NAMESPACE, METRICS_ENABLED)
+
+class Tracer:
+    """
+    Lightweight spans for one invocation. start_trace() decides whether
+    the invocation is sampled; span() then times a block, nesting under
+    the thread's current span or an explicit parent (for work handed
+    to other threads). export() writes a sampled trace as one JSON log
+    line. Unsampled spans cost a single flag check.
+    """
+    
+    def __init__(self, sample_rate=0.0, clock=time.perf_counter):
+        self.sample_rate = sample_rate
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.sampled = False
+        self.trace_id = None
+        self.started = 0.0
+        self.spans = []
+    
+    def start_trace(self, force=False):
+        self.sampled = force or random.random() < self.sample_rate
+        self.trace_id = os.urandom(8).hex()
+        self.started = self.clock()
+        self.spans = []
+        self.local = threading.local()
+    
+    def current(self):
+        """Id of the innermost open span on this thread, to parent spans on other threads"""
+        return getattr(self.local, 'span_id', None)
+    
+    @contextlib.contextmanager
+    def span(self, name, parent=None, **attributes):
+        if not self.sampled:
+            yield None
+            return
+        
+        span_id = os.urandom(4).hex()
+        outer = self.current()
+        span = {
+            'name': name,
+            'span_id': span_id,
+            'parent_id': parent or outer,
+            'start_ms': round((self.clock() - self.started) * 1000, 3),
+            'duration_ms': None,
+            'attributes': attributes
+        }
+        self.local.span_id = span_id
+        started = self.clock()
+        try:
+            yield span
+        except Exception as e:
+            span['error'] = str(e)
+            raise
+        finally:
+            span['duration_ms'] = round((self.clock() - started) * 1000, 3)
+            self.local.span_id = outer
+            with self.lock:
+                self.spans.append(span)
+    
+    def slowest(self, count=10):
+        return sorted(self.spans, key=lambda span: span['duration_ms'], reverse=True)[:count]
+    
+    def export(self, write=print):
+        """Write the sampled trace as a JSON line; returns it, or None if unsampled"""
+        if not self.sampled or not self.spans:
+            return None
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span['start_ms'])
+        line = json.dumps({'trace_id': self.trace_id, 'spans': spans})
+        write(line)
+        return line
+
+# Sampled per invocation; spans are exported before the metrics flush
+tracer = Tracer(TRACE_SAMPLE_RATE)
+
+class DeadlineExceeded(Exception):
+    """Raised for work that would run past its channel's deadline"""
+
+class DeadlineScheduler:
+    """
+    Splits what is left of the invocation, as reported by
+    context.get_remaining_time_in_millis(), between channels. A
+    reserve is held back to return the response, and each channel may
+    use a share of the rest set by its priority, so low-priority
+    channels are cut first and high-priority ones (PagerDuty) last.
+    Retries stop at the channel's deadline, and payloads not sent by
+    then are handed to the outbound queue; half of the reserve is the
+    grace period for that hand-off. Without a context nothing is cut.
+    """
+    
+    def __init__(self, reserve_seconds=1.5, shares=None, clock=time.monotonic):
+        self.reserve_seconds = reserve_seconds
+        self.grace_seconds = reserve_seconds / 2
+        self.shares = shares or PRIORITY_SHARES
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.budget = None
+        self.deferred = Counter()
+    
+    def start(self, context=None):
+        """Begin an invocation; a context without get_remaining_time_in_millis means no deadline"""
+        self.started = self.clock()
+        self.deferred = Counter()
+        remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        self.budget = max(0.0, remaining() / 1000 - self.reserve_seconds) if remaining else None
+    
+    def deadline(self, channel=None):
+        """Clock time by which channel has to finish, or None when unbounded"""
+        if self.budget is None:
+            return None
+        share = self.shares[get_channel_config(channel)['priority']] if channel else 1.0
+        return self.started + self.budget * share
+    
+    def time_left(self, channel=None):
+        deadline = self.deadline(channel)
+        return float('inf') if deadline is None else max(0.0, deadline - self.clock())
+    
+    def expired(self, channel=None):
+        return self.time_left(channel) <= 0
+    
+    def defer(self, channel):
+        with self.lock:
+            self.deferred[channel] += 1
+    
+    def stats(self):
+        return {
+            'budget_seconds': round(self.budget, 3) if self.budget is not None else None,
+            'deferred': dict(self.deferred)
+        }
+
+# Started per invocation from the Lambda context
+scheduler = DeadlineScheduler(DEADLINE_RESERVE_SECONDS)
+
+def handler(event, context):
+    """
+    Lambda function to receive Prometheus Alert Manager webhooks
+    and forward them to configured notification channels
+    """
+    
+    tracer.start_trace()
+    scheduler.start(context)
+    try:
+        with tracer.span('handler'):
+            # Decode the invocation (Function URL, SNS, SQS or raw payload);
+            # batched records are merged and dispatched together
+            with tracer.span('decode'):
+                payloads = decode_event(event)
+                alerts = [alert for body in payloads for alert in body.get('alerts', [])]
+                external_url = next((body['externalURL'] for body in payloads if body.get('externalURL')), '')
+            
+            print(f"Processing {len(alerts)} alerts from {len(payloads)} payload(s) across enabled channels")
+            
+            # Normalize every alert once; all channels share the same batch
+            with tracer.span('normalize', alerts=len(alerts)):
+                batch = AlertBatch(alerts)
+            
+            # Only forward alerts whose status changed since they were last sent
+            with tracer.span('dedup'):
+                cache = get_dedup_cache() if DEDUP_ENABLED else None
+                changed_alerts = AlertBatch(cache.filter_changes(batch), observed=batch) if cache else batch
+            if cache:
+                print(f"Dedup: forwarding {len(changed_alerts)} of {len(alerts)} alerts "
+                      f"(hits={cache.hits}, misses={cache.misses})")
+            metrics.record('AlertsProcessed', len(alerts))
+            metrics.record('AlertsForwarded', len(changed_alerts))
+            metrics.record('DedupHits', len(alerts) - len(changed_alerts) if cache else 0)
+            
+            # Channels replay deliveries spilled by earlier invocations as they run
+            channels = get_enabled_channels()
+            outbound = get_outbound_queue()
+            if outbound:
+                outbound.begin(channels)
+            
+            # Split alerts between channels by routing rules and transition subscriptions
+            routes = None
+            if changed_alerts:
+                with tracer.span('route'):
+                    routes = select_alerts(channels, batch, changed_alerts, cache.pending if cache else None)
+            if routes is not None:
+                targets = [driver for driver in channels if routes[driver.name] or driver.is_due()]
+            elif changed_alerts:
+                targets = channels
+            else:
+                targets = [driver for driver in channels if driver.is_due()]
+            if outbound:
+                targets = [driver for driver in channels
+                           if driver in targets or outbound.waiting(driver.name)]
+            
+            # Send notifications to all targeted channels concurrently
+            with tracer.span('dispatch', channels=len(targets)):
+                notifications_sent, notifications_spilled, channel_errors, timings = dispatch_notifications(
+                    targets, changed_alerts, external_url, routes=routes
+                )
+            
+            # Remember what was delivered or spilled; the next re-send goes
+            # out again only to the channels that failed
+            if cache:
+                failed = {}
+                for name in channel_errors:
+                    for alert in routes[name] if routes is not None else changed_alerts:
+                        failed.setdefault(alert.fingerprint, []).append(name)
+                with tracer.span('remember'):
+                    cache.remember(changed_alerts, failed)
+            
+            for name in channel_errors:
+                metrics.record('ChannelErrors', 1, channel=name)
+            if outbound:
+                for name, count in outbound.spilled.items():
+                    metrics.record('Spilled', count, channel=name)
+                for name, count in outbound.store.dead_lettered.items():
+                    metrics.record('DeadLettered', count, channel=name)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'message': f'Successfully processed {len(alerts)} alerts',
+                'processed_alerts': len(alerts),
+                'payloads': len(payloads),
+                'forwarded_alerts': len(changed_alerts),
+                'notifications_sent': notifications_sent,
+                'notifications_spilled': notifications_spilled,
+                'channel_errors': channel_errors,
+                'timings_ms': timings,
+                'dedup': cache.stats() if cache else None,
+                'transitions': dict(changed_alerts.transition_counts) if cache else None,
+                'routed': {name: len(batch) for name, batch in routes.items()} if routes else None,
+                'outbound': outbound.stats() if outbound else None,
+                'deadline': scheduler.stats(),
+                'connections': http_transport.stats() if http_transport else {}
+            })
+        }
+        
+    except Exception as e:
+        print(f"Error processing webhook: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': str(e),
+                'message': 'Failed to process webhook'
+            })
+        }
+    
+    finally:
+        tracer.export()
+        metrics.flush()
+
+def decode_event(event):
+    """Return the Alertmanager payloads carried by an invocation event"""
+    for matches, decode in INPUT_DECODERS:
+        if matches(event):
+            return decode(event)
+    return []
+
+def is_record_batch(event, source):
+    records = event.get('Records')
+    return bool(records) and all(
+        (record.get('EventSource') or record.get('eventSource')) == source for record in records
+    )
+
+def decode_sns_event(event):
+    """SNS subscription: one Alertmanager payload per record's Message"""
+    return parse_payloads(record.get('Sns', {}).get('Message') for record in event['Records'])
+
+def decode_sqs_event(event):
+    """SQS batch: one payload per record body, unwrapping SNS envelopes"""
+    return parse_payloads(record.get('body') for record in event['Records'])
+
+def decode_function_url_event(event):
+    """
+    Function URL / API Gateway request, possibly base64-encoded. A body
+    that is not JSON is the caller's error, so the ValueError propagates
+    and the handler answers with an error status instead of skipping it.
+    """
+    body = event['body']
+    if isinstance(body, str) and event.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    if isinstance(body, (str, bytes)):
+        body = get_json_codec().loads(body)
+    return parse_payloads([body])
+
+def decode_raw_event(event):
+    """Direct invocation with the Alertmanager payload as the event"""
+    return parse_payloads([event])
+
+# Checked in order; add new sources ahead of the raw fallback
+INPUT_DECODERS = [
+    (lambda event: is_record_batch(event, 'aws:sns'), decode_sns_event),
+    (lambda event: is_record_batch(event, 'aws:sqs'), decode_sqs_event),
+    (lambda event: 'body' in event, decode_function_url_event),
+    (lambda event: True, decode_raw_event),
+]
+
+def parse_payloads(messages):
+    """
+    Parse raw messages into Alertmanager payload dicts. SNS
+    notification envelopes are unwrapped; messages that are not
+    Alertmanager JSON (for example our own email summaries coming
+    back through the topic) are skipped.
+    """
+    payloads = []
+    for message in messages:
+        if isinstance(message, (str, bytes)):
+            try:
+                message = get_json_codec().loads(message)
+            except ValueError:
+                print("Skipping record that is not JSON")
+                continue
+        if isinstance(message, dict) and message.get('Type') == 'Notification' and 'Message' in message:
+            payloads.extend(parse_payloads([message['Message']]))
+        elif isinstance(message, dict) and 'alerts' in message:
+            payloads.append(message)
+        else:
+            print("Skipping record without an 'alerts' list")
+    return payloads
+
+def get_enabled_channels():
+    """Return the driver for each enabled channel, in dispatch order"""
+    return [get_digest_driver(driver) for driver in CHANNEL_DRIVERS if driver.is_enabled()]
+
+def dispatch_notifications(channels, alerts, external_url, timeout=None, routes=None):
+    """
+    Send alerts to every channel driver at the same time.
+    Each channel gets its own deadline (the timeout, or the
+    scheduler's deadline for it plus a grace period to spill unsent
+    work, if sooner); a slow or failing channel never holds up the
+    others. With routes ({channel name: AlertBatch}) each channel
+    gets only its routed alerts. Returns (sent, spilled, errors,
+    timings_ms): sent lists the channels that delivered everything,
+    spilled those that queued some payloads for a later invocation,
+    both in channel order.
+    
+    Timed-out channels get up to CHANNEL_SHUTDOWN_GRACE_SECONDS more
+    to finish. Known limitation: a thread still running after that
+    cannot be stopped. Lambda freezes it when the handler returns and
+    resumes it in the next invocation, where its late sends are
+    counted in that invocation's metrics and trace.
+    """
+    if timeout is None:
+        timeout = CHANNEL_TIMEOUT_SECONDS
+    
+    notifications_sent = []
+    notifications_spilled = []
+    channel_errors = {}
+    timings = {}
+    if not channels:
+        return notifications_sent, notifications_spilled, channel_errors, timings
+    
+    started = time.monotonic()
+    deadline = started + timeout
+    executor = ThreadPoolExecutor(max_workers=len(channels))
+    futures = [
+        (driver.name, driver.display_name,
+         executor.submit(run_channel, driver, routes[driver.name] if routes else alerts,
+                         external_url, tracer.current()))
+        for driver in channels
+    ]
+    
+    for name, display_name, future in futures:
+        wait = min(deadline - time.monotonic(), scheduler.time_left(name) + scheduler.grace_seconds)
+        try:
+            elapsed, error = future.result(timeout=max(0.0, wait))
+        except FutureTimeoutError:
+            elapsed = time.monotonic() - started
+            error = TimeoutError(f"no response within {elapsed:.1f}s")
+        
+        timings[name] = round(elapsed * 1000, 1)
+        if error is None:
+            notifications_sent.append(name)
+        elif isinstance(error, DeliverySpilled):
+            notifications_spilled.append(name)
+            print(f"{display_name} notification not sent yet: {str(error)}")
+        else:
+            channel_errors[name] = str(error)
+            print(f"Error sending {display_name} notification: {str(error)}")
+    
+    # Give timed-out channels a bounded chance to finish before returning
+    late = [future for _, _, future in futures if not future.done()]
+    if late:
+        grace = min(CHANNEL_SHUTDOWN_GRACE_SECONDS, scheduler.time_left() + scheduler.grace_seconds)
+        _, still_running = wait_futures(late, timeout=max(0.0, grace))
+        if still_running:
+            print(f"{len(still_running)} channel(s) still running after a {grace:.1f}s grace period")
+    executor.shutdown(wait=False)
+    
+    total_ms = round((time.monotonic() - started) * 1000, 1)
+    breakdown = ", ".join(f"{name}={ms}ms" for name, ms in timings.items())
+    print(f"Dispatch finished in {total_ms}ms ({breakdown})")
+    timings['total'] = total_ms
+    return notifications_sent, notifications_spilled, channel_errors, timings
+
+def run_channel(driver, alerts, external_url, parent=None):
+    """
+    Run one channel driver, returning (elapsed seconds, error or None).
+    The channel first replays its own spilled deliveries, so a slow
+    replay only holds up that channel. A channel that spilled any
+    payload instead of sending it returns DeliverySpilled.
+    """
+    started = time.monotonic()
+    queue = get_outbound_queue()
+    spilled_before = queue.spilled[driver.name] if queue else 0
+    try:
+        with tracer.span('channel', parent=parent, channel=driver.name):
+            # Replay this channel's earlier spills ahead of its new payloads
+            if queue:
+                with tracer.span('drain', channel=driver.name):
+                    queue.drain(driver)
+            if alerts or driver.is_due():
+                driver.send_batch(alerts, external_url)
+    except Exception as e:
+        return time.monotonic() - started, e
+    spilled = queue.spilled[driver.name] - spilled_before if queue else 0
+    if spilled:
+        return time.monotonic() - started, DeliverySpilled(f"{spilled} payload(s) spilled for retry")
+    return time.monotonic() - started, None
+
+class LabelMatcher:
+    """
+    One Alertmanager-style matcher: label=value, label!=value,
+    label=~regex or label!~regex. Regexes are fully anchored and a
+    missing label matches as the empty string, as in Alertmanager.
+    """
+    __slots__ = ('label', 'op', 'value', 'regex')
+    
+    SYNTAX = re.compile(r'^\s*([a-zA-Z_]\w*)\s*(=~|!~|!=|=)\s*(?:"((?:[^"\\]|\\.)*)"|(.*?))\s*$')
+    LITERALS = re.compile(r'[\w\-:/ ]+(?:\|[\w\-:/ ]+)*')
+    
+    def __init__(self, label, op, value):
+        self.label = label
+        self.op = op
+        self.value = value
+        self.regex = re.compile(value) if op in ('=~', '!~') else None
+    
+    @classmethod
+    def parse(cls, text):
+        match = cls.SYNTAX.match(text)
+        if not match:
+            raise ValueError(f"Invalid matcher: {text!r}")
+        label, op, quoted, bare = match.groups()
+        value = re.sub(r'\\(.)', r'\1', quoted) if quoted is not None else bare
+        return cls(label, op, value)
+    
+    def matches(self, labels):
+        actual = labels.get(self.label, '')
+        if self.op == '=':
+            return actual == self.value
+        if self.op == '!=':
+            return actual != self.value
+        found = self.regex.fullmatch(actual) is not None
+        return found if self.op == '=~' else not found
+    
+    def anchors(self):
+        """The label values this matcher needs, or None if it can match any value"""
+        if self.op == '=' and self.value:
+            return [self.value]
+        if self.op == '=~' and self.LITERALS.fullmatch(self.value):
+            return self.value.split('|')
+        return None
+
+RoutingRule = namedtuple('RoutingRule', 'matchers channels stop')
+
+class AlertRouter:
+    """
+    Routes each alert to the channels of every rule whose matchers all
+    match, in rule order, stopping after a rule with `stop`. Alerts no
+    rule matches go to default_channels ("*" is every enabled channel).
+    
+    Rules are compiled once into an index keyed by label name: each
+    rule is filed under the values of one of its equality (or literal
+    alternation) matchers, so an alert only looks up its own label
+    values and checks the few rules found there, plus any rules that
+    have no such matcher.
+    """
+    
+    def __init__(self, rules, default_channels=('*',)):
+        self.rules = rules
+        self.default_channels = list(default_channels)
+        self.index = {}
+        self.unanchored = []
+        for position, rule in enumerate(rules):
+            anchored = [(matcher, matcher.anchors()) for matcher in rule.matchers]
+            anchored = [(matcher, values) for matcher, values in anchored if values]
+            if not anchored:
+                self.unanchored.append(position)
+                continue
+            matcher, values = min(anchored, key=lambda item: len(item[1]))
+            by_value = self.index.setdefault(matcher.label, {})
+            for value in values:
+                by_value.setdefault(value, []).append(position)
+    
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build from {"routes": [{"matchers": [...], "channels": [...],
+        "stop": false}], "default": ["*"]}; a bare list is the routes.
+        """
+        if isinstance(config, list):
+            config = {'routes': config}
+        known = {driver.name for driver in CHANNEL_DRIVERS} | {'*'}
+        rules = []
+        for route in config.get('routes', []):
+            channels = list(route.get('channels', []))
+            unknown = set(channels) - known
+            if unknown:
+                raise ValueError(f"Unknown channel(s) in routing rule: {', '.join(sorted(unknown))}")
+            matchers = [LabelMatcher.parse(text) for text in route.get('matchers', [])]
+            rules.append(RoutingRule(matchers, channels, bool(route.get('stop', False))))
+        return cls(rules, config.get('default', ['*']))
+    
+    def candidates(self, labels):
+        found = set(self.unanchored)
+        for name, value in labels.items():
+            by_value = self.index.get(name)
+            if by_value:
+                found.update(by_value.get(value, ()))
+        return sorted(found)
+    
+    def channels_for(self, labels):
+        channels = []
+        matched = False
+        for position in self.candidates(labels):
+            rule = self.rules[position]
+            if all(matcher.matches(labels) for matcher in rule.matchers):
+                matched = True
+                channels.extend(channel for channel in rule.channels if channel not in channels)
+                if rule.stop:
+                    break
+        return channels if matched else self.default_channels
+    
+    def route(self, alerts, channel_names):
+        """Split AlertRecords into {channel name: [records]} over the given channels"""
+        routed = {name: [] for name in channel_names}
+        for alert in alerts:
+            targets = self.channels_for(alert.labels)
+            for name in (channel_names if '*' in targets else targets):
+                if name in routed:
+                    routed[name].append(alert)
+        return routed
+
+def select_alerts(channels, observed, forwarded, pending=None):
+    """
+    Pick each channel's share of the forwarded alerts: those routed to
+    it that carry a transition it subscribes to. pending ({fingerprint:
+    channel names}) holds alerts other channels already delivered; they
+    go only to the channels named. Returns {channel name: AlertBatch},
+    or None when every channel takes the whole batch.
+    """
+    pending = pending or {}
+    router = get_router()
+    subscriptions = {driver.name: get_channel_config(driver.name)['transitions'] for driver in channels}
+    if router is None and not any(subscriptions.values()) and not pending:
+        return None
+    
+    names = [driver.name for driver in channels]
+    routed = router.route(observed, names) if router else dict.fromkeys(names, observed.records)
+    forwarded_ids = {id(record) for record in forwarded}
+    selected = {}
+    for name in names:
+        wanted = subscriptions[name]
+        selected[name] = AlertBatch([
+            record for record in routed[name]
+            if id(record) in forwarded_ids
+            and not (wanted and record.transition and record.transition not in wanted)
+            and (record.fingerprint not in pending or name in pending[record.fingerprint])
+        ], observed=routed[name])
+    return selected
+
+@functools.lru_cache(maxsize=None)
+def get_router():
+    """Compile the routing rules once per cold start; None when no rules are configured"""
+    text = os.environ.get('ROUTING_RULES', '')
+    if ROUTING_RULES_FILE:
+        with open(ROUTING_RULES_FILE, encoding='utf-8') as f:
+            text = f.read()
+    if not text.strip():
+        return None
+    return AlertRouter.from_config(json.loads(text))
+
+SEVERITY_RANK = {'critical': 0, 'error': 1, 'warning': 2, 'info': 3}
+
+# Severity/status styling for every channel, looked up once per alert
+AlertStyle = namedtuple('AlertStyle', 'emoji slack_color discord_color teams_color')
+RESOLVED_STYLE = AlertStyle('✅', 'good', 3066993, '2eb886')  # Green
+DEFAULT_STYLE = AlertStyle('🔔', '#808080', 8421504, '636e72')  # Gray
+SEVERITY_STYLES = {
+    'critical': AlertStyle('🚨', 'danger', 15158332, 'd63031'),  # Red
+    'warning': AlertStyle('⚠️', 'warning', 16776960, 'fdcb6e'),  # Yellow
+    'info': AlertStyle('ℹ️', '#808080', 8421504, '636e72'),
+}
+
+def get_alert_style(severity, status):
+    """Styling for an alert from the precomputed lookup table"""
+    if status == 'resolved':
+        return RESOLVED_STYLE
+    return SEVERITY_STYLES.get(severity, DEFAULT_STYLE)
+
+class AlertRecord:
+    """Normalized view of one Alertmanager alert, extracted once"""
+    
+    __slots__ = (
+        'raw', 'labels', 'annotations', 'name', 'severity', 'status',
+        'instance', 'job', 'summary', 'description', 'style', 'transition',
+        '_fingerprint', '_title', '_line'
+    )
+    
+    def __init__(self, alert):
+        labels = alert.get('labels') or {}
+        annotations = alert.get('annotations') or {}
+        self.raw = alert
+        self.labels = labels
+        self.annotations = annotations
+        self.name = labels.get('alertname', 'Unknown Alert')
+        self.severity = labels.get('severity', 'unknown')
+        self.status = alert.get('status', 'unknown')
+        self.instance = labels.get('instance', 'unknown')
+        self.job = labels.get('job', 'unknown')
+        self.summary = annotations.get('summary', 'No summary available')
+        self.description = annotations.get('description', 'No description available')
+        self.style = get_alert_style(self.severity, self.status)
+        self.transition = None
+        self._fingerprint = None
+        self._title = None
+        self._line = None
+    
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = get_alert_fingerprint(self.raw)
+        return self._fingerprint
+    
+    @property
+    def title(self):
+        """'<emoji> <alertname>', shared by every channel's rendering"""
+        if self._title is None:
+            self._title = f"{self.style.emoji} {self.name}"
+        return self._title
+    
+    @property
+    def line(self):
+        """'<emoji> <alertname> (<severity>)' as listed in summaries"""
+        if self._line is None:
+            self._line = f"{self.title} ({self.severity})"
+        return self._line
+    
+    @property
+    def rank(self):
+        """Sort key: firing before resolved, then most severe first"""
+        return (self.status == 'resolved', SEVERITY_RANK.get(self.severity, 4))
+
+class AlertBatch:
+    """
+    A group of AlertRecords with severity/status histograms and a
+    per-alertname grouping, all computed in a single pass.
+    Behaves like a read-only sequence of records. Transition counts
+    cover `observed` (the records before dedup) when given.
+    """
+    
+    def __init__(self, alerts, observed=None):
+        self.records = [a if isinstance(a, AlertRecord) else AlertRecord(a) for a in alerts]
+        self.severity_counts = Counter()
+        self.status_counts = Counter()
+        self.by_name = {}
+        for record in self.records:
+            self.severity_counts[record.severity] += 1
+            self.status_counts[record.status] += 1
+            self.by_name.setdefault(record.name, []).append(record)
+        self.transition_counts = Counter(
+            record.transition for record in (self.records if observed is None else observed)
+            if record.transition
+        )
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def __iter__(self):
+        return iter(self.records)
+    
+    def __getitem__(self, index):
+        return self.records[index]
+    
+    @property
+    def critical_count(self):
+        return self.severity_counts['critical']
+    
+    @property
+    def warning_count(self):
+        return self.severity_counts['warning']
+    
+    @property
+    def firing_count(self):
+        return self.status_counts['firing']
+    
+    @property
+    def resolved_count(self):
+        return self.status_counts['resolved']
+    
+    @property
+    def transition_summary(self):
+        """'3 new, 12 ongoing, 5 resolved', or '' without alert state"""
+        if not self.transition_counts:
+            return ''
+        return ', '.join(f"{self.transition_counts[name]} {name}" for name in TRANSITIONS)
+    
+    def top(self, n):
+        """The n most important alerts, keeping arrival order among equals"""
+        if n >= len(self.records):
+            return sorted(self.records, key=lambda record: record.rank)
+        return heapq.nsmallest(n, self.records, key=lambda record: record.rank)
+
+def get_alert_fingerprint(alert):
+    """Stable hash of an alert's full label set"""
+    labels = get_json_codec().dumps_sorted(alert.get('labels', {}))
+    return hashlib.sha256(labels).hexdigest()[:32]
+
+AlertState = namedtuple('AlertState', 'status first_seen last_sent count expires_at transition retry',
+                        defaults=(None, ()))
+AlertState.__doc__ = """
+Stored per fingerprint: the last delivered status, when the current
+episode started, when it was last notified and how many notifications
+the episode has had. The entry is dropped once expires_at passes.
+transition is the one last notified and retry names the channels that
+failed to deliver it, so the next re-send goes to those channels only.
+"""
+
+TRANSITIONS = ('new', 'ongoing', 'resolved')
+
+class InMemoryDedupBackend:
+    """Size-bounded LRU store kept in the warm Lambda container"""
+    
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def put(self, key, state):
+        self._entries[key] = state
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get_many(self, keys):
+        """{key: state} for the keys that have an entry"""
+        states = {}
+        for key in keys:
+            state = self.get(key)
+            if state is not None:
+                states[key] = state
+        return states
+    
+    def put_many(self, states):
+        for key, state in states.items():
+            self.put(key, state)
+    
+    def evict_expired(self, now):
+        for key in [k for k, state in self._entries.items() if state.expires_at <= now]:
+            del self._entries[key]
+    
+    def flush(self):
+        pass
+    
+    def __len__(self):
+        return len(self._entries)
+
+class FileDedupBackend(InMemoryDedupBackend):
+    """
+    In-memory store loaded from, and written back to, one JSON file
+    so state survives process restarts when the file does (local runs,
+    or an EFS mount).
+    """
+    
+    def __init__(self, path, max_entries=10000):
+        super().__init__(max_entries)
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = {}
+        for key, fields in entries.items():
+            self.put(key, AlertState(*fields))
+    
+    def flush(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({key: list(state) for key, state in self._entries.items()}, f, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+class DynamoDBDedupBackend:
+    """
+    Store backed by a DynamoDB table keyed on `fingerprint`. Reads use
+    batch_get_item (100 keys per call) and writes a batch_writer (25
+    items per call), both stopping at the invocation's deadline: keys
+    not read by then count as unseen, and unwritten states are sent
+    again on the next re-send. Any object exposing batch_get_item and
+    Table(name).batch_writer() like boto3's DynamoDB resource works, so
+    a local stand-in can replace DynamoDB. Enable the table's TTL on
+    `expires_at` to have DynamoDB evict old entries.
+    """
+    batch_get_size = 100
+    
+    def __init__(self, resource, table_name):
+        self.resource = resource
+        self.table_name = table_name
+        self.table = resource.Table(table_name)
+    
+    def get_many(self, keys):
+        states = {}
+        keys = list(dict.fromkeys(keys))  # batch_get_item rejects duplicate keys
+        for start in range(0, len(keys), self.batch_get_size):
+            request = {self.table_name: {
+                'Keys': [{'fingerprint': key} for key in keys[start:start + self.batch_get_size]]
+            }}
+            for attempt in range(1, HTTP_MAX_ATTEMPTS + 1):
+                if scheduler.expired():
+                    print(f"Deadline reached reading dedup state; {len(keys) - len(states)} alerts treated as unseen")
+                    return states
+                response = self.resource.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    states[item['fingerprint']] = AlertState(
+                        item['status'],
+                        float(item.get('first_seen', 0)),
+                        float(item.get('last_sent', 0)),
+                        int(item.get('count', 0)),
+                        float(item['expires_at']),
+                        item.get('transition'),
+                        tuple(item.get('retry') or ())
+                    )
+                # Throttled keys come back unprocessed; back off and ask again
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                time.sleep(min(get_backoff_delay(attempt), scheduler.time_left()))
+        return states
+    
+    def put_many(self, states):
+        with self.table.batch_writer(overwrite_by_pkeys=['fingerprint']) as batch:
+            for written, (key, state) in enumerate(states.items()):
+                # The response is held for the grace period at most
+                if scheduler.time_left() + scheduler.grace_seconds <= 0:
+                    print(f"Deadline reached writing dedup state; {len(states) - written} alerts not recorded")
+                    break
+                batch.put_item(Item={
+                    'fingerprint': key,
+                    'status': state.status,
+                    'first_seen': int(state.first_seen),
+                    'last_sent': int(state.last_sent),
+                    'count': state.count,
+                    'expires_at': int(state.expires_at),
+                    'transition': state.transition,
+                    'retry': list(state.retry)
+                })
+    
+    def evict_expired(self, now):
+        pass
+    
+    def flush(self):
+        pass
+
+class DedupCache:
+    """
+    Tracks each alert's state by fingerprint and suppresses alerts
+    whose status has not changed since they were last delivered.
+    Every observed alert is tagged with its transition: 'new' (first
+    seen, or firing again after resolving), 'ongoing' (still firing)
+    or 'resolved'. Unchanged alerts are re-notified once ttl_seconds
+    have passed since the last notification; state is kept for
+    state_ttl_seconds after it so first-seen times survive reminders.
+    Delivery is recorded per channel: an alert that some channels
+    failed to deliver is forwarded again, with its original
+    transition, and `pending` limits it to those channels.
+    """
+    
+    def __init__(self, backend, ttl_seconds=3600, state_ttl_seconds=86400, clock=time.time):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.state_ttl_seconds = max(state_ttl_seconds, ttl_seconds)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._episodes = {}
+        self.pending = {}
+    
+    def filter_changes(self, alerts):
+        """Tag every AlertRecord with its transition; return those that are new, changed or due"""
+        now = self.clock()
+        self.backend.evict_expired(now)
+        self._episodes = {}
+        self.pending = {}
+        states = self.backend.get_many(alert.fingerprint for alert in alerts)
+        changed = []
+        for alert in alerts:
+            state = states.get(alert.fingerprint)
+            if state and state.expires_at <= now:
+                state = None
+            resolved = alert.status == 'resolved'
+            if state is None or state.status != alert.status:
+                alert.transition = 'resolved' if resolved else 'new'
+                episode = (state.first_seen, state.count) if state and resolved else (now, 0)
+            else:
+                alert.transition = 'resolved' if resolved else 'ongoing'
+                if now - state.last_sent < self.ttl_seconds:
+                    if not state.retry:
+                        self.hits += 1
+                        continue
+                    # Same notification again, for the channels that missed it
+                    alert.transition = state.transition or alert.transition
+                    self.pending[alert.fingerprint] = set(state.retry)
+                    episode = (state.first_seen, state.count - 1)
+                else:
+                    episode = (state.first_seen, state.count)
+            self.misses += 1
+            self._episodes[alert.fingerprint] = episode
+            changed.append(alert)
+        return changed
+    
+    def remember(self, alerts, failed=None):
+        """
+        Record alerts as notified in their current status; failed maps
+        a fingerprint to the channels that did not deliver it.
+        """
+        failed = failed or {}
+        now = self.clock()
+        states = {}
+        for alert in alerts:
+            first_seen, count = self._episodes.get(alert.fingerprint, (now, 0))
+            states[alert.fingerprint] = AlertState(
+                alert.status, first_seen, now, count + 1, now + self.state_ttl_seconds,
+                alert.transition, tuple(sorted(failed.get(alert.fingerprint, ())))
+            )
+        self.backend.put_many(states)
+        self.backend.flush()
+    
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+def get_dedup_cache():
+    """Create the dedup cache on first use and keep it for warm invocations"""
+    global dedup_cache
+    if dedup_cache is None:
+        if DEDUP_TABLE_NAME:
+            import boto3
+            backend = DynamoDBDedupBackend(boto3.resource('dynamodb'), DEDUP_TABLE_NAME)
+        elif DEDUP_STATE_FILE:
+            backend = FileDedupBackend(DEDUP_STATE_FILE, DEDUP_MAX_ENTRIES)
+        else:
+            backend = InMemoryDedupBackend(DEDUP_MAX_ENTRIES)
+        dedup_cache = DedupCache(backend, DEDUP_TTL_SECONDS, DEDUP_STATE_TTL_SECONDS)
+    return dedup_cache
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`"""
+    
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+    
+    def try_acquire(self, tokens=1):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+class RateLimitExceeded(Exception):
+    """Raised when a destination's token bucket is empty"""
+
+class RateLimiter:
+    """One token bucket per destination URL; unknown URLs are unlimited"""
+    
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def configure(self, url, rate, capacity):
+        if url and rate > 0:
+            self._buckets[url] = TokenBucket(rate, capacity, self.clock)
+    
+    def try_acquire(self, url):
+        bucket = self._buckets.get(url)
+        if bucket is None:
+            return True
+        with self._lock:
+            return bucket.try_acquire()
+
+def parse_transitions(value):
+    """Parse 'new,resolved' into a frozenset; empty means every transition"""
+    transitions = frozenset(part.strip() for part in value.split(',') if part.strip())
+    unknown = transitions - set(TRANSITIONS)
+    if unknown:
+        raise ValueError(f"Unknown transition(s): {', '.join(sorted(unknown))}")
+    return transitions or None
+
+def parse_priority(value):
+    """Validate a channel priority against PRIORITY_SHARES"""
+    priority = value.strip().lower()
+    if priority not in PRIORITY_SHARES:
+        raise ValueError(f"Unknown priority: {value!r} (expected one of {', '.join(PRIORITY_SHARES)})")
+    return priority
+
+def parse_rate_limit(value):
+    """Parse '<rate>:<burst>' into (rate, burst); '0' disables limiting"""
+    rate, _, burst = value.partition(':')
+    rate = float(rate or 0)
+    return rate, float(burst) if burst else max(1.0, rate)
+
+def get_rate_limiter():
+    """Create the per-webhook rate limiter on first use"""
+    global rate_limiter
+    if rate_limiter is None:
+        limiter = RateLimiter()
+        for name, enabled in (('slack', SLACK_ENABLED), ('discord', DISCORD_ENABLED), ('teams', TEAMS_ENABLED)):
+            if enabled:
+                config = get_channel_config(name)
+                limiter.configure(config['webhook_url'], *config['rate_limit'])
+        rate_limiter = limiter
+    return rate_limiter
+
+# AWS error codes that mean "slow down" even though they come back as a 400
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'ThrottledException',
+                          'RequestThrottledException', 'TooManyRequestsException'}
+
+def is_retryable(error):
+    """
+    True for a failure that a later attempt may get past: a deadline,
+    our own rate limit, a connection error or timeout, a 408/425/429/5xx
+    response, or AWS throttling. Anything else (a 400, a bad topic ARN)
+    fails for good.
+    """
+    if isinstance(error, HTTPDeliveryError):
+        return error.status is None or error.status in RETRYABLE_STATUSES
+    if isinstance(error, (DeadlineExceeded, RateLimitExceeded, TimeoutError, ConnectionError)):
+        return True
+    try:
+        from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+    except ImportError:
+        return False
+    if isinstance(error, ClientError):
+        return (error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+                or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in RETRYABLE_STATUSES)
+    return isinstance(error, (BotoConnectionError, HTTPClientError))
+
+# A replay stopped by one of these never reached the destination: the
+# message is kept as it is, without counting a failed replay
+REPLAY_DEFERRALS = (DeadlineExceeded, RateLimitExceeded)
+
+class SpillFull(Exception):
+    pass
+
+class DeliverySpilled(Exception):
+    """A channel's payloads were queued for a later invocation rather than sent"""
+
+class FileSpillStore:
+    """
+    Spilled deliveries as JSON lines, one file per destination, so each
+    destination drains in the order its messages failed. Each line
+    counts its failed replays; a message that fails for good, or
+    max_replays times, moves to the destination's dead-letter file so
+    it stops holding back the messages behind it. The default directory
+    is Lambda's /tmp, which lives as long as the container; use
+    SQSSpillStore when deliveries must survive it.
+    """
+    
+    def __init__(self, directory, max_messages=1000, max_replays=5):
+        self.directory = directory
+        self.max_messages = max_messages
+        self.max_replays = max_replays
+        self.counts = {}
+        self.dead_lettered = Counter()
+        self.lock = threading.Lock()
+    
+    def path(self, destination):
+        return os.path.join(self.directory, f"{destination}.jsonl")
+    
+    def dead_letter_path(self, destination):
+        return os.path.join(self.directory, f"{destination}.dead.jsonl")
+    
+    def begin(self, destinations):
+        pass
+    
+    def waiting(self, destination):
+        """True if destination has spilled messages to replay"""
+        return os.path.exists(self.path(destination))
+    
+    def push(self, destination, payload):
+        path = self.path(destination)
+        count = self.counts.get(destination)
+        if count is None:
+            count = 0
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    count = sum(1 for _ in f)
+        if count >= self.max_messages:
+            raise SpillFull(f"{count} deliveries already spilled for {destination}")
+        
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'payload': payload, 'replays': 0}) + '\n')
+        self.counts[destination] = count + 1
+    
+    def drain(self, send, destinations, limit, workers=1):
+        """
+        Replay up to limit messages per destination through
+        send(destination, payload), stopping a destination at its first
+        failure that keeps a message. With workers > 1 the destination's
+        messages are independent: that many are replayed at a time and
+        a failure holds back only itself. Only the replayed messages are
+        loaded; the rest are streamed. Returns the destinations that
+        still have messages waiting.
+        """
+        pending = set()
+        for destination in destinations:
+            path = self.path(destination)
+            if not os.path.exists(path):
+                continue
+            
+            with open(path, encoding='utf-8') as source, \
+                    open(path + '.tmp', 'w', encoding='utf-8') as rest:
+                batch = [get_json_codec().loads(line) for line in itertools.islice(source, limit)]
+                if workers > 1 and batch:
+                    with ThreadPoolExecutor(max_workers=min(workers, len(batch))) as executor:
+                        done = list(executor.map(lambda entry: self.replay(send, destination, entry), batch))
+                    kept = [entry for entry, finished in zip(batch, done) if not finished]
+                else:
+                    kept = []
+                    for index, entry in enumerate(batch):
+                        if not self.replay(send, destination, entry):
+                            kept = batch[index:]
+                            break
+                for entry in kept:
+                    rest.write(json.dumps(entry) + '\n')
+                count = len(kept)
+                for line in source:
+                    rest.write(line)
+                    count += 1
+            
+            if count:
+                os.replace(path + '.tmp', path)
+                pending.add(destination)
+            else:
+                os.remove(path + '.tmp')
+                os.remove(path)
+            self.counts[destination] = count
+        return pending
+    
+    def replay(self, send, destination, entry):
+        """Replay one entry; False if it stays spilled"""
+        try:
+            send(destination, entry['payload'])
+            return True
+        except Exception as e:
+            print(f"Spilled delivery to {destination} failed again: {str(e)}")
+            if isinstance(e, REPLAY_DEFERRALS):
+                return False
+            entry['replays'] += 1
+            if is_retryable(e) and entry['replays'] < self.max_replays:
+                return False
+            self.dead_letter(destination, entry, e)
+            return True
+    
+    def dead_letter(self, destination, entry, error):
+        with self.lock:
+            with open(self.dead_letter_path(destination), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(entry, error=str(error), failed_at=time.time())) + '\n')
+            self.dead_lettered[destination] += 1
+        print(f"Dead-lettered a delivery to {destination} after {entry['replays']} replay(s): {str(error)}")
+
+class SQSSpillStore:
+    """
+    Spilled deliveries in an SQS FIFO queue, grouped by destination so
+    SQS keeps each destination's order. begin() receives what is
+    waiting and buffers it per destination, so each channel can then
+    drain its own messages concurrently with the others. A message
+    that fails for good, or still fails after being received
+    max_replays times, is logged in full and deleted so it stops
+    holding back its group. Any object exposing send_message/
+    receive_message/delete_message like boto3's SQS client works, so a
+    local stand-in can replace SQS.
+    """
+    
+    def __init__(self, client, queue_url, max_replays=5):
+        self.client = client
+        self.queue_url = queue_url
+        self.max_replays = max_replays
+        self.dead_lettered = Counter()
+        self.lock = threading.Lock()
+        self.received = {}
+    
+    def push(self, destination, payload):
+        body = json.dumps({'destination': destination, 'payload': payload})
+        self.client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=body,
+            MessageGroupId=destination,
+            MessageDeduplicationId=hashlib.sha256(f"{time.time_ns()}:{body}".encode()).hexdigest()
+        )
+    
+    def begin(self, destinations):
+        """Buffer the messages waiting for destinations, until a receive comes back empty"""
+        with self.lock:
+            self.received = {destination: deque() for destination in destinations}
+        # A FIFO group is not returned again while its messages are in flight
+        for _ in range(len(destinations) + 1):
+            if not self.receive():
+                break
+    
+    def waiting(self, destination):
+        with self.lock:
+            return bool(self.received.get(destination))
+    
+    def receive(self):
+        """One receive call; False if it returned nothing"""
+        messages = self.client.receive_message(
+            QueueUrl=self.queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=0,
+            AttributeNames=['ApproximateReceiveCount']
+        ).get('Messages', [])
+        with self.lock:
+            for message in messages:
+                entry = get_json_codec().loads(message['Body'])
+                buffered = self.received.get(entry['destination'])
+                # Messages for other destinations stay in flight until their visibility timeout
+                if buffered is not None:
+                    buffered.append((message, entry))
+        return bool(messages)
+    
+    def take(self, destination, count):
+        with self.lock:
+            buffered = self.received.setdefault(destination, deque())
+            return [buffered.popleft() for _ in range(min(count, len(buffered)))]
+    
+    def drain(self, send, destinations, limit, workers=1):
+        # Messages left undeleted reappear after the visibility timeout and,
+        # being FIFO, hold back the rest of their group until then
+        pending = set()
+        for destination in destinations:
+            attempted = 0
+            receives = 0
+            while attempted < limit:
+                wave = self.take(destination, min(workers, limit - attempted))
+                if not wave:
+                    # Deleting a group's messages lets SQS return the next ones
+                    receives += 1
+                    if receives > limit or not self.receive():
+                        break
+                    continue
+                attempted += len(wave)
+                if workers > 1:
+                    with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+                        done = list(executor.map(lambda item: self.replay(send, destination, *item), wave))
+                else:
+                    done = [self.replay(send, destination, *wave[0])]
+                if not all(done):
+                    pending.add(destination)
+                    if workers == 1:
+                        break
+            else:
+                pending.add(destination)
+            with self.lock:
+                if self.received.pop(destination, None):
+                    pending.add(destination)
+        return pending
+    
+    def replay(self, send, destination, message, entry):
+        """Replay one message, deleting it unless it stays queued; False if it does"""
+        try:
+            send(destination, entry['payload'])
+        except Exception as e:
+            print(f"Spilled delivery to {destination} failed again: {str(e)}")
+            receives = int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+            if isinstance(e, REPLAY_DEFERRALS) or (is_retryable(e) and receives < self.max_replays):
+                return False
+            with self.lock:
+                self.dead_lettered[destination] += 1
+            print(f"Dead-lettered a delivery to {destination} after {receives} receive(s): "
+                  f"{str(e)}: {message['Body']}")
+        self.client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+        return True
+
+class OutboundQueue:
+    """
+    Delivery queue in front of a spill store. A send that fails in a
+    way a retry may fix (see is_retryable) is spilled and replayed on a
+    later invocation instead of being lost; any other failure is raised
+    to the channel. Each channel replays its own spills when it runs,
+    before its new payloads. While an ordered channel has spilled
+    messages, new ones are queued behind them so it is delivered in
+    order; unordered channels (PagerDuty) always try new payloads and
+    replay through their worker pool.
+    """
+    
+    def __init__(self, store, drain_limit=50):
+        self.store = store
+        self.drain_limit = drain_limit
+        self.lock = threading.Lock()
+        self.blocked = set()
+        self.spilled = Counter()
+        self.drained = Counter()
+    
+    def begin(self, drivers):
+        """Start an invocation: reset its counts and let the store find what waits"""
+        self.spilled.clear()
+        self.drained.clear()
+        self.store.dead_lettered.clear()
+        self.blocked = set()
+        self.store.begin([driver.name for driver in drivers])
+    
+    def waiting(self, destination):
+        """True if destination has spilled messages to replay"""
+        return destination in self.blocked or self.store.waiting(destination)
+    
+    def drain(self, driver):
+        """Replay one channel driver's earlier spills, oldest first"""
+        name = driver.name
+        
+        def replay(destination, payload):
+            if scheduler.expired(destination):
+                raise DeadlineExceeded(f"{destination} deadline reached while replaying")
+            driver.send(payload)
+            with self.lock:
+                self.drained[destination] += 1
+        
+        workers = 1 if driver.ordered else driver.concurrency
+        pending = self.store.drain(replay, [name], self.drain_limit, workers)
+        with self.lock:
+            if name in pending:
+                self.blocked.add(name)
+            else:
+                self.blocked.discard(name)
+        if self.drained[name] or name in pending or self.store.dead_lettered[name]:
+            print(f"Outbound queue: replayed {self.drained[name]} for {name}, "
+                  f"dead-lettered {self.store.dead_lettered[name]}, "
+                  f"{'more waiting' if name in pending else 'none left'}")
+    
+    def deliver(self, destination, payload, send, ordered=True):
+        """Send payload now, or spill it; returns True if it was sent"""
+        if not (ordered and destination in self.blocked):
+            try:
+                send(payload)
+                return True
+            except RateLimitExceeded:
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                print(f"Delivery to {destination} failed, spilling for a later invocation: {str(e)}")
+        self.spill(destination, payload)
+        return False
+    
+    def spill(self, destination, payload):
+        with self.lock:
+            self.store.push(destination, payload)
+            self.blocked.add(destination)
+            self.spilled[destination] += 1
+    
+    def stats(self):
+        return {
+            'spilled': dict(self.spilled),
+            'replayed': dict(self.drained),
+            'dead_lettered': dict(self.store.dead_lettered),
+            'waiting': sorted(self.blocked)
+        }
+
+def get_outbound_queue():
+    """Create the outbound queue on first use and keep it for warm invocations"""
+    global outbound_queue
+    if not SPILL_ENABLED:
+        return None
+    if outbound_queue is None:
+        if SPILL_QUEUE_URL:
+            import boto3
+            store = SQSSpillStore(boto3.client('sqs'), SPILL_QUEUE_URL, SPILL_MAX_REPLAYS)
+        else:
+            store = FileSpillStore(SPILL_DIR, SPILL_MAX_MESSAGES, SPILL_MAX_REPLAYS)
+        outbound_queue = OutboundQueue(store, SPILL_DRAIN_MAX)
+    return outbound_queue
+
+class ChannelDriver(abc.ABC):
+    """
+    A notification channel. render() turns alerts into request
+    payloads, each paired with the alerts it covers; send() posts one
+    payload and send_batch() delivers a whole batch. Batching drivers
+    pack up to max_batch_size alerts into a single request. Channels
+    that can be digested also provide render_digest(digest, now),
+    returning one payload that rolls up an AlertDigest.
+    """
+    name = None
+    display_name = None
+    max_batch_size = 1  # alerts per request; None when only the message size bounds it
+    ordered = True  # new payloads wait behind spilled ones
+    
+    @property
+    def supports_batching(self):
+        """True if one request can carry several alerts"""
+        return self.max_batch_size is None or self.max_batch_size > 1
+    
+    @property
+    def concurrency(self):
+        """Payloads the channel may have in flight at once"""
+        return 1
+    
+    @abc.abstractmethod
+    def is_enabled(self):
+        """True if the channel is switched on and configured"""
+    
+    def is_due(self):
+        """True if the channel has buffered work to send even without new alerts"""
+        return False
+    
+    @abc.abstractmethod
+    def render(self, alerts, external_url):
+        """Return [(payload, alerts covered)] for the batch"""
+    
+    @abc.abstractmethod
+    def send(self, payload):
+        """Post one rendered payload, raising if it was not accepted"""
+    
+    def send_batch(self, alerts, external_url):
+        """Render and deliver alerts, returning the number of payloads"""
+        with tracer.span('render', channel=self.name, alerts=len(alerts)):
+            payloads = self.render(alerts, external_url)
+        for payload, _ in payloads:
+            self.deliver(payload)
+        return len(payloads)
+    
+    def deliver(self, payload, send=None, parent=None):
+        """
+        Send one payload through the outbound queue; False if it was
+        spilled, including when the channel's deadline has passed.
+        """
+        send = send or self.send
+        queue = get_outbound_queue()
+        with tracer.span('send', parent=parent, channel=self.name) as span:
+            if scheduler.expired(self.name):
+                scheduler.defer(self.name)
+                if queue is None:
+                    raise DeadlineExceeded(f"{self.display_name} deadline reached before sending")
+                queue.spill(self.name, payload)
+                return False
+            if queue is None:
+                send(payload)
+                return True
+            sent = queue.deliver(self.name, payload, send, self.ordered)
+            if span is not None:
+                span['attributes']['spilled'] = not sent
+            return sent
+
+class EmailDriver(ChannelDriver):
+    """Email via SNS; several alerts become one summary (split if oversized)"""
+    name = 'email'
+    display_name = 'email'
+    max_batch_size = None  # bounded by SNS_MAX_MESSAGE_BYTES, not alert count
+    
+    def is_enabled(self):
+        return EMAIL_ENABLED and bool(get_channel_config('email')['topic_arn'])
+    
+    def render(self, alerts, external_url):
+        if not alerts:
+            return []
+        if len(alerts) == 1:
+            alert = alerts[0]
+            subject = f"{alert.style.emoji} Prometheus Alert: {alert.name} ({alert.severity.upper()})"
+            body = truncate_utf8(format_email_alert(alert, external_url), SNS_MAX_MESSAGE_BYTES)
+            return [((subject, body), [alert])]
+        
+        subject = (f"🚨 Prometheus Alert Summary: {len(alerts)} alerts "
+                   f"({alerts.critical_count} critical, {alerts.warning_count} warning)")
+        messages = render_email_summary(
+            alerts, external_url, split=EMAIL_OVERFLOW_MODE == 'split'
+        )
+        if len(messages) == 1:
+            return [((subject, messages[0]), list(alerts))]
+        return [
+            ((f"{subject} [{part}/{len(messages)}]", body), list(alerts))
+            for part, body in enumerate(messages, 1)
+        ]
+    
+    def render_digest(self, digest, now):
+        subject = f"📬 Prometheus Alert Digest: {digest.state['alerts']} alerts"
+        return subject, truncate_utf8("\n".join(digest.lines(now)), SNS_MAX_MESSAGE_BYTES)
+    
+    def send(self, payload):
+        subject, body = payload
+        started = time.monotonic()
+        try:
+            send_sns_message(subject, body)
+        except Exception:
+            metrics.record('DeliveryErrors', 1, channel=self.name)
+            raise
+        finally:
+            metrics.record('SendLatency', round((time.monotonic() - started) * 1000, 1), 'Milliseconds', self.name)
+        metrics.record('Requests', 1, channel=self.name)
+        metrics.record('PayloadBytes', utf8_len(body), 'Bytes', self.name)
+
+class WebhookDriver(ChannelDriver):
+    """
+    A JSON webhook behind the rate limiter. Several alerts are packed
+    into as few messages as the channel's limits allow, most important
+    first. When the destination is over its rate limit the unsent
+    alerts are held and folded into the next batch for the same URL
+    instead of being dropped; the channel stays due until they go out,
+    so any later invocation (an Alertmanager re-send included) flushes
+    them.
+    """
+    max_message_size = None  # per-message limit, in the units of item_size()
+    
+    @property
+    def url(self):
+        return get_channel_config(self.name)['webhook_url']
+    
+    def is_due(self):
+        """True while alerts held back by the rate limiter wait for this URL"""
+        return bool(coalesced_alerts.get(self.url))
+    
+    def render(self, alerts, external_url):
+        if not alerts:
+            return []
+        if len(alerts) == 1:
+            return [(self.render_alert(alerts[0]), [alerts[0]])]
+        
+        ordered = alerts.top(len(alerts))
+        if not self.supports_batching:
+            return [(self.render_alert(alert), [alert]) for alert in ordered]
+        items = [self.render_item(alert) for alert in ordered]
+        limit = self.max_message_size
+        if limit is not None:
+            limit -= self.batch_overhead(alerts)
+        sizes = [self.item_size(item, alert) for item, alert in zip(items, ordered)]
+        messages = pack_items(sizes, self.max_batch_size, limit)
+        return [
+            (self.render_batch(alerts, RawJSON('[' + ','.join(items[i] for i in indexes) + ']'),
+                               part, len(messages)),
+             [ordered[i] for i in indexes])
+            for part, indexes in enumerate(messages, 1)
+        ]
+    
+    @abc.abstractmethod
+    def render_alert(self, alert):
+        """The payload for a single alert"""
+    
+    @abc.abstractmethod
+    def render_item(self, alert):
+        """One alert as an element of the message's item list"""
+    
+    @abc.abstractmethod
+    def render_batch(self, alerts, items, part, parts):
+        """The payload wrapping a JSON list of rendered items"""
+    
+    def item_size(self, item, alert):
+        return len(item) + 1  # JSON text plus the separating comma
+    
+    def batch_overhead(self, alerts):
+        """Size of the message around its items, reserved from max_message_size"""
+        return len(self.render_batch(alerts, RawJSON('[]'), 99, 99))
+    
+    def send(self, payload):
+        return send_http_request(self.url, payload, channel=self.name)
+    
+    def send_batch(self, alerts, external_url):
+        url = self.url
+        backlog = coalesced_alerts.pop(url, None)
+        batch = AlertBatch(merge_alerts(backlog, alerts)) if backlog else alerts
+        with tracer.span('render', channel=self.name, alerts=len(batch)):
+            payloads = self.render(batch, external_url)
+        for index, (payload, _) in enumerate(payloads):
+            try:
+                self.deliver(payload)
+            except RateLimitExceeded as e:
+                held = [alert for _, covered in payloads[index:] for alert in covered]
+                coalesced_alerts[url] = held[-COALESCE_MAX_ALERTS:]
+                print(f"{str(e)}; {len(coalesced_alerts[url])} alerts held for the next summary")
+                return index
+        return len(payloads)
+
+class SlackDriver(WebhookDriver):
+    name = 'slack'
+    display_name = 'Slack'
+    max_batch_size = 20  # attachments Slack renders per message
+    max_message_size = 40000  # characters of message JSON
+    
+    def is_enabled(self):
+        return SLACK_ENABLED and bool(self.url)
+    
+    def render_alert(self, alert):
+        return render_slack_alert(alert)
+    
+    def render_digest(self, digest, now):
+        return get_payload_template('slack', 'digest').render(
+            text="*📬 Prometheus Alert Digest*\n" + "\n".join(digest.lines(now))
+        )
+    
+    def render_item(self, alert):
+        return render_slack_item(alert)
+    
+    def render_batch(self, alerts, items, part, parts):
+        return render_slack_batch(alerts, items, part, parts)
+
+class DiscordDriver(WebhookDriver):
+    name = 'discord'
+    display_name = 'Discord'
+    max_batch_size = 10  # embeds per message
+    max_message_size = 6000  # characters of embed text per message
+    
+    def is_enabled(self):
+        return DISCORD_ENABLED and bool(self.url)
+    
+    def render_alert(self, alert):
+        return render_discord_alert(alert)
+    
+    def render_digest(self, digest, now):
+        return get_payload_template('discord', 'digest').render(
+            text="**📬 Prometheus Alert Digest**\n" + "\n".join(digest.lines(now))
+        )
+    
+    def render_item(self, alert):
+        return render_discord_item(alert)
+    
+    def render_batch(self, alerts, items, part, parts):
+        return render_discord_batch(alerts, items, part, parts)
+    
+    def item_size(self, item, alert):
+        # Discord counts the visible text of an embed, not its JSON
+        return (len(alert.title) + len(alert.summary) + len(alert.status) + len(alert.severity)
+                + len(alert.instance) + len("StatusSeverityInstance") + len("Prometheus Alert Manager"))
+    
+    def batch_overhead(self, alerts):
+        return 0  # the header goes in "content", outside the embed limit
 
-PAGERDUTY_ENABLED = os.environ.get('PAGERDUTY_ENABLED', 'false').lower() == 'true'
-PAGERDUTY_INTEGRATION_KEY = os.environ.get('PAGERDUTY_INTEGRATION_KEY', '')
-PAGERDUTY_SEVERITY_MAP = json.loads(os.environ.get('PAGERDUTY_SEVERITY_MAP', '{}'))
+class TeamsDriver(WebhookDriver):
+    name = 'teams'
+    display_name = 'Teams'
+    max_batch_size = 10  # sections Teams renders per connector card
+    max_message_size = 28000  # bytes; Teams rejects larger connector cards
+    
+    def is_enabled(self):
+        return TEAMS_ENABLED and bool(self.url)
+    
+    def render_alert(self, alert):
+        return render_teams_alert(alert)
+    
+    def render_digest(self, digest, now):
+        return get_payload_template('teams', 'digest').render(
+            summary=f"{digest.state['alerts']} alerts",
+            text="\n\n".join(line for line in digest.lines(now) if line)
+        )
+    
+    def render_item(self, alert):
+        return render_teams_item(alert)
+    
+    def render_batch(self, alerts, items, part, parts):
+        return render_teams_batch(alerts, items, part, parts)
 
-def handler(event, context):
+class PagerDutyDriver(ChannelDriver):
     """
-    Lambda function to receive Prometheus Alert Manager webhooks
-    and forward them to configured notification channels
+    PagerDuty Events API, one event per alert fingerprint; alerts
+    superseded later in the same batch are not sent. Events are posted
+    by a bounded worker pool; every alert succeeds or fails on its own
+    and failures are raised together at the end. Events are independent
+    per dedup_key, so the channel is unordered: a spilled event never
+    holds back the others, and spills are replayed through the pool.
     """
+    name = 'pagerduty'
+    display_name = 'PagerDuty'
+    ordered = False
     
-    try:
-        # Parse the incoming webhook payload
-        if 'body' in event:
-            if isinstance(event['body'], str):
-                body = json.loads(event['body'])
-            else:
-                body = event['body']
-        else:
-            body = event
-        
-        # Extract alert information
-        alerts = body.get('alerts', [])
-        group_labels = body.get('groupLabels', {})
-        common_labels = body.get('commonLabels', {})
-        common_annotations = body.get('commonAnnotations', {})
-        external_url = body.get('externalURL', '')
-        
-        print(f"Processing {len(alerts)} alerts across enabled channels")
-        
-        # Send notifications to enabled channels
-        notifications_sent = []
-        
-        # Email notifications via SNS
-        if EMAIL_ENABLED and SNS_TOPIC_ARN:
-            try:
-                send_email_notifications(alerts, external_url)
-                notifications_sent.append('email')
-            except Exception as e:
-                print(f"Error sending email notification: {str(e)}")
-        
-        # Slack notifications
-        if SLACK_ENABLED and SLACK_WEBHOOK_URL:
-            try:
-                send_slack_notifications(alerts, external_url)
-                notifications_sent.append('slack')
-            except Exception as e:
-                print(f"Error sending Slack notification: {str(e)}")
-        
-        # Discord notifications
-        if DISCORD_ENABLED and DISCORD_WEBHOOK_URL:
-            try:
-                send_discord_notifications(alerts, external_url)
-                notifications_sent.append('discord')
-            except Exception as e:
-                print(f"Error sending Discord notification: {str(e)}")
-        
-        # Microsoft Teams notifications
-        if TEAMS_ENABLED and TEAMS_WEBHOOK_URL:
-            try:
-                send_teams_notifications(alerts, external_url)
-                notifications_sent.append('teams')
-            except Exception as e:
-                print(f"Error sending Teams notification: {str(e)}")
-        
-        # PagerDuty notifications
-        if PAGERDUTY_ENABLED and PAGERDUTY_INTEGRATION_KEY:
-            try:
-                send_pagerduty_notifications(alerts, external_url)
-                notifications_sent.append('pagerduty')
-            except Exception as e:
-                print(f"Error sending PagerDuty notification: {str(e)}")
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': f'Successfully processed {len(alerts)} alerts',
-                'processed_alerts': len(alerts),
-                'notifications_sent': notifications_sent
-            })
-        }
-        
-    except Exception as e:
-        print(f"Error processing webhook: {str(e)}")
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'error': str(e),
-                'message': 'Failed to process webhook'
-            })
+    @property
+    def concurrency(self):
+        return get_channel_config('pagerduty')['max_concurrency']
+    
+    def is_enabled(self):
+        return PAGERDUTY_ENABLED and bool(get_channel_config('pagerduty')['integration_key'])
+    
+    def render(self, alerts, external_url):
+        return [(render_pagerduty_event(group[-1], external_url), group) for group in coalesce_events(alerts)]
+    
+    def send(self, payload, gate=None, attempt_log=None):
+        config = get_channel_config('pagerduty')
+        return send_http_request(
+            config['events_url'], payload,
+            max_attempts=config['max_attempts'], gate=gate, attempt_log=attempt_log,
+            channel=self.name
+        )
+    
+    def send_batch(self, alerts, external_url):
+        results = self.deliver_all(alerts, external_url)
+        failed = [result for result in results if result['error']]
+        spilled = sum(1 for result in results if result['spilled'])
+        print(f"PagerDuty: {len(results) - len(failed) - spilled}/{len(results)} events accepted, "
+              f"{spilled} spilled")
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} of {len(results)} PagerDuty events failed "
+                f"(first: {failed[0]['dedup_key']}: {failed[0]['error']})"
+            )
+        return len(results)
+    
+    def deliver_all(self, alerts, external_url):
+        """Post every final-state event through the worker pool, returning result dicts"""
+        events = [group[-1] for group in coalesce_events(alerts)]
+        if not events:
+            return []
+        if len(events) < len(alerts):
+            print(f"PagerDuty: coalesced {len(alerts)} alerts into {len(events)} events")
+        gate = BackpressureGate()
+        parent = tracer.current()
+        workers = max(1, min(self.concurrency, len(events)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(
+                lambda alert: self.deliver_event(alert, external_url, gate, parent),
+                events
+            ))
+    
+    def deliver_event(self, alert, external_url, gate, parent=None):
+        """Post one PagerDuty event; returns a result dict instead of raising"""
+        attempts = []
+        responses = []
+        result = {
+            'dedup_key': get_pagerduty_dedup_key(alert), 'status': None,
+            'attempts': 0, 'error': None, 'spilled': False
         }
+        try:
+            with tracer.span('render', parent=parent, channel=self.name, alerts=1):
+                payload = render_pagerduty_event(alert, external_url)
+            sent = self.deliver(
+                payload,
+                lambda payload: responses.append(self.send(payload, gate=gate, attempt_log=attempts)),
+                parent=parent
+            )
+            result['spilled'] = not sent
+            if sent:
+                result['status'] = responses[0].status
+        except (HTTPDeliveryError, DeadlineExceeded, SpillFull) as e:
+            result['status'] = getattr(e, 'status', None)
+            result['error'] = str(e)
+        result['attempts'] = len(attempts)
+        return result
 
-def send_email_notifications(alerts, external_url):
-    """Send email notifications via SNS"""
-    if len(alerts) > 1:
-        send_email_summary(alerts, external_url)
-    elif len(alerts) == 1:
-        send_individual_email(alerts[0], external_url)
-
-def send_individual_email(alert, external_url):
-    """Send notification for a single alert via email"""
-    alert_name = alert.get('labels', {}).get('alertname', 'Unknown Alert')
-    severity = alert.get('labels', {}).get('severity', 'unknown')
-    status = alert.get('status', 'unknown')
-    
-    emoji = get_alert_emoji(severity, status)
-    subject = f"{emoji} Prometheus Alert: {alert_name} ({severity.upper()})"
-    
-    message_body = format_email_alert(alert, external_url)
-    send_sns_message(subject, message_body)
-
-def send_email_summary(alerts, external_url):
-    """Send summary notification for multiple alerts via email"""
-    total_alerts = len(alerts)
-    critical_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'critical'])
-    warning_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'warning'])
-    
-    subject = f"🚨 Prometheus Alert Summary: {total_alerts} alerts ({critical_count} critical, {warning_count} warning)"
-    message_body = format_email_summary(alerts, external_url)
-    send_sns_message(subject, message_body)
-
-def send_slack_notifications(alerts, external_url):
-    """Send notifications to Slack"""
-    if len(alerts) > 1:
-        send_slack_summary(alerts, external_url)
-    else:
-        send_slack_individual(alerts[0], external_url)
-
-def send_slack_individual(alert, external_url):
-    """Send individual alert to Slack"""
-    alert_name = alert.get('labels', {}).get('alertname', 'Unknown Alert')
-    severity = alert.get('labels', {}).get('severity', 'unknown')
-    status = alert.get('status', 'unknown')
-    instance = alert.get('labels', {}).get('instance', 'unknown')
-    summary = alert.get('annotations', {}).get('summary', 'No summary available')
-    
-    color = get_slack_color(severity, status)
-    emoji = get_alert_emoji(severity, status)
-    
-    payload = {
-        "channel": SLACK_CHANNEL,
-        "username": SLACK_USERNAME,
-        "icon_emoji": ":warning:",
-        "attachments": [
-            {
-                "color": color,
-                "title": f"{emoji} {alert_name}",
-                "text": summary,
-                "fields": [
-                    {"title": "Status", "value": status.upper(), "short": True},
-                    {"title": "Severity", "value": severity.upper(), "short": True},
-                    {"title": "Instance", "value": instance, "short": True},
-                    {"title": "Job", "value": alert.get('labels', {}).get('job', 'unknown'), "short": True}
-                ],
-                "footer": "Prometheus Alert Manager",
-                "ts": int(datetime.now().timestamp())
-            }
+class AlertDigest:
+    """
+    Rolled-up counts of the alerts a channel received during one digest
+    window. Only counters are kept, so the state stays small however
+    many alerts arrive, and it round-trips through a plain dict.
+    """
+    
+    def __init__(self, state):
+        self.state = state
+    
+    @classmethod
+    def open(cls, now):
+        return cls({
+            'opened_at': now, 'alerts': 0, 'firing': 0, 'resolved': 0,
+            'severities': {}, 'names': {}, 'external_url': ''
+        })
+    
+    def add(self, alerts, external_url=''):
+        state = self.state
+        state['alerts'] += len(alerts)
+        if len(alerts):
+            state['firing'] += alerts.firing_count
+            state['resolved'] += alerts.resolved_count
+            for severity, count in alerts.severity_counts.items():
+                state['severities'][severity] = state['severities'].get(severity, 0) + count
+            for name, records in alerts.by_name.items():
+                state['names'][name] = state['names'].get(name, 0) + len(records)
+        if external_url:
+            state['external_url'] = external_url
+    
+    def top_names(self, count=10):
+        return heapq.nlargest(count, self.state['names'].items(), key=lambda item: item[1])
+    
+    def lines(self, now):
+        """Plain-text body shared by every channel's digest message"""
+        state = self.state
+        minutes = max(1, round((now - state['opened_at']) / 60))
+        severities = sorted(state['severities'].items(), key=lambda item: SEVERITY_RANK.get(item[0], 99))
+        lines = [
+            f"{state['alerts']} alerts in the last {minutes} minutes",
+            f"Firing: {state['firing']}, resolved: {state['resolved']}",
+            ", ".join(f"{severity}: {count}" for severity, count in severities),
+            "",
+            "Most frequent:"
         ]
-    }
+        lines.extend(f"  {name}: {count}" for name, count in self.top_names())
+        if state['external_url']:
+            lines.extend(["", f"Alert Manager: {state['external_url']}"])
+        return lines
+
+class FileDigestStore:
+    """Open digest windows as JSON files, one per channel"""
+    
+    def __init__(self, directory):
+        self.directory = directory
     
-    send_http_request(SLACK_WEBHOOK_URL, payload)
+    def path(self, channel):
+        return os.path.join(self.directory, f"{channel}.json")
+    
+    def load(self, channel):
+        try:
+            with open(self.path(channel), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def save(self, channel, state):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(channel)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+    
+    def delete(self, channel):
+        try:
+            os.remove(self.path(channel))
+        except FileNotFoundError:
+            pass
 
-def send_slack_summary(alerts, external_url):
-    """Send alert summary to Slack"""
-    total_alerts = len(alerts)
-    critical_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'critical'])
-    warning_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'warning'])
-    firing_count = len([a for a in alerts if a.get('status') == 'firing'])
+class DynamoDBDigestStore:
+    """
+    Open digest windows in a DynamoDB table keyed on `channel`. Any
+    object exposing get_item/put_item/delete_item like boto3's Table
+    works, so a local stand-in can replace DynamoDB.
+    """
     
-    color = "danger" if critical_count > 0 else "warning"
+    def __init__(self, table):
+        self.table = table
     
-    alert_list = []
-    for alert in alerts[:5]:  # Show first 5 alerts
-        alert_name = alert.get('labels', {}).get('alertname', 'Unknown')
-        severity = alert.get('labels', {}).get('severity', 'unknown')
-        status = alert.get('status', 'unknown')
-        emoji = get_alert_emoji(severity, status)
-        alert_list.append(f"{emoji} {alert_name} ({severity})")
+    def load(self, channel):
+        item = self.table.get_item(Key={'channel': channel}).get('Item')
+        return json.loads(item['state']) if item else None
     
-    if len(alerts) > 5:
-        alert_list.append(f"... and {len(alerts) - 5} more alerts")
+    def save(self, channel, state):
+        self.table.put_item(Item={'channel': channel, 'state': json.dumps(state)})
     
-    payload = {
-        "channel": SLACK_CHANNEL,
-        "username": SLACK_USERNAME,
-        "icon_emoji": ":rotating_light:",
+    def delete(self, channel):
+        self.table.delete_item(Key={'channel': channel})
+
+class DigestDriver(ChannelDriver):
+    """
+    Wraps a channel so its alerts are collected over a window of
+    `window` seconds and sent as one rolled-up message when the window
+    closes. The open window is persisted, so it survives between
+    invocations; it is checked (and sent) on the first invocation after
+    it closes. The wrapped driver must provide render_digest().
+    """
+    
+    def __init__(self, driver, window, store, clock=time.time):
+        self.driver = driver
+        self.window = window
+        self.store = store
+        self.clock = clock
+        self.name = driver.name
+        self.display_name = driver.display_name
+    
+    def is_enabled(self):
+        return self.driver.is_enabled()
+    
+    def is_due(self):
+        state = self.store.load(self.name)
+        return bool(state) and self.clock() - state['opened_at'] >= self.window
+    
+    def render(self, alerts, external_url):
+        return self.driver.render(alerts, external_url)
+    
+    def send(self, payload):
+        return self.driver.send(payload)
+    
+    def send_batch(self, alerts, external_url):
+        now = self.clock()
+        state = self.store.load(self.name)
+        digest = AlertDigest(state) if state else AlertDigest.open(now)
+        digest.add(alerts, external_url)
+        # Persist before sending so a failed send keeps the window's counts
+        self.store.save(self.name, digest.state)
+        metrics.record('Digested', len(alerts), channel=self.name)
+        
+        if now - digest.state['opened_at'] < self.window:
+            return 0
+        if digest.state['alerts']:
+            with tracer.span('render', channel=self.name, alerts=digest.state['alerts']):
+                payload = self.driver.render_digest(digest, now)
+            self.driver.deliver(payload)
+        self.store.delete(self.name)
+        return 1
+
+def get_digest_driver(driver):
+    """The digesting wrapper for a channel with a digest window, else the driver itself"""
+    window = get_channel_config(driver.name).get('digest_window', 0)
+    if not window:
+        return driver
+    if driver.name not in digest_drivers:
+        if DIGEST_TABLE_NAME:
+            import boto3
+            store = DynamoDBDigestStore(boto3.resource('dynamodb').Table(DIGEST_TABLE_NAME))
+        else:
+            store = FileDigestStore(DIGEST_DIR)
+        digest_drivers[driver.name] = DigestDriver(driver, window, store)
+    return digest_drivers[driver.name]
+
+# Dispatch order; register new channels here
+CHANNEL_DRIVERS = [EmailDriver(), SlackDriver(), DiscordDriver(), TeamsDriver(), PagerDutyDriver()]
+
+def get_driver(name):
+    for driver in CHANNEL_DRIVERS:
+        if driver.name == name:
+            return driver
+    raise KeyError(name)
+
+def merge_alerts(earlier, later):
+    """Combine AlertRecord lists, keeping the latest copy of each fingerprint"""
+    merged = {}
+    for alert in list(earlier) + list(later):
+        merged.pop(alert.fingerprint, None)
+        merged[alert.fingerprint] = alert
+    return list(merged.values())
+
+def pack_items(sizes, max_count=None, max_size=None):
+    """
+    First-fit bin packing that keeps priority order: each item goes
+    into the first message with room for it, so the most important
+    alerts lead. An item larger than max_size gets a message of its
+    own. Returns a list of item index lists, one per message.
+    """
+    messages = []
+    open_messages = []  # [indexes, size used], still able to take an item
+    smallest = min(sizes, default=0)
+    for index, size in enumerate(sizes):
+        for message in open_messages:
+            if max_size is None or message[1] + size <= max_size:
+                break
+        else:
+            message = [[], 0]
+            messages.append(message)
+            open_messages.append(message)
+        message[0].append(index)
+        message[1] += size
+        if ((max_count is not None and len(message[0]) >= max_count)
+                or (max_size is not None and message[1] + smallest > max_size)):
+            open_messages.remove(message)
+    return [indexes for indexes, _ in messages]
+
+def coalesce_events(alerts):
+    """
+    Group alerts by fingerprint, ordered by each group's last
+    occurrence. The last alert in a group is its final state; earlier
+    ones (a trigger resolved later in the same batch, say) are
+    superseded and need no event of their own.
+    """
+    groups = {}
+    for alert in alerts:
+        group = groups.pop(alert.fingerprint, [])
+        group.append(alert)
+        groups[alert.fingerprint] = group
+    return list(groups.values())
+
+def get_pagerduty_dedup_key(alert):
+    """Stable across invocations and unique per label set"""
+    return alert.fingerprint
+
+class PayloadTemplate:
+    """
+    A JSON payload compiled once. The skeleton is serialized up front
+    with "@@name@@" placeholders; render() splices in the JSON-encoded
+    values, giving exactly what json.dumps would for the filled dict.
+    """
+    
+    PLACEHOLDER = re.compile(r'"@@(\w+)@@"')
+    
+    def __init__(self, skeleton):
+        self.parts = self.PLACEHOLDER.split(json.dumps(skeleton))
+    
+    def render(self, **values):
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            value = values[parts[i]]
+            parts[i] = encode_basestring_ascii(value) if type(value) is str else encode_json_value(value)
+        return ''.join(parts)
+
+class RawJSON(str):
+    """Already-encoded JSON that PayloadTemplate splices in verbatim"""
+
+def encode_json_value(value):
+    """json.dumps for one value, with a fast path for strings and ints"""
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int.__repr__(value)
+    return json.dumps(value)
+
+def slack_alert_template(config):
+    return {
+        "channel": config['channel'],
+        "username": config['username'],
+        "icon_emoji": ":warning:",
         "attachments": [
             {
-                "color": color,
-                "title": f"🚨 Prometheus Alert Summary",
-                "text": f"*{total_alerts} alerts* ({critical_count} critical, {warning_count} warning, {firing_count} firing)",
+                "color": "@@color@@",
+                "title": "@@title@@",
+                "text": "@@text@@",
                 "fields": [
-                    {
-                        "title": "Active Alerts",
-                        "value": "\n".join(alert_list),
-                        "short": False
-                    }
+                    {"title": "Status", "value": "@@status@@", "short": True},
+                    {"title": "Severity", "value": "@@severity@@", "short": True},
+                    {"title": "Instance", "value": "@@instance@@", "short": True},
+                    {"title": "Job", "value": "@@job@@", "short": True}
                 ],
                 "footer": "Prometheus Alert Manager",
-                "ts": int(datetime.now().timestamp())
+                "ts": "@@ts@@"
             }
         ]
     }
-    
-    send_http_request(SLACK_WEBHOOK_URL, payload)
 
-def send_discord_notifications(alerts, external_url):
-    """Send notifications to Discord"""
-    if len(alerts) > 1:
-        send_discord_summary(alerts, external_url)
-    else:
-        send_discord_individual(alerts[0], external_url)
+def slack_item_template(config):
+    return slack_alert_template(config)['attachments'][0]
 
-def send_discord_individual(alert, external_url):
-    """Send individual alert to Discord"""
-    alert_name = alert.get('labels', {}).get('alertname', 'Unknown Alert')
-    severity = alert.get('labels', {}).get('severity', 'unknown')
-    status = alert.get('status', 'unknown')
-    summary = alert.get('annotations', {}).get('summary', 'No summary available')
-    
-    color = get_discord_color(severity, status)
-    emoji = get_alert_emoji(severity, status)
-    
-    payload = {
-        "username": DISCORD_USERNAME,
+def slack_batch_template(config):
+    return {
+        "channel": config['channel'],
+        "username": config['username'],
+        "icon_emoji": ":rotating_light:",
+        "text": "@@text@@",
+        "attachments": "@@items@@"
+    }
+
+def slack_digest_template(config):
+    return {
+        "channel": config['channel'],
+        "username": config['username'],
+        "icon_emoji": ":mailbox:",
+        "text": "@@text@@"
+    }
+
+def discord_alert_template(config):
+    return {
+        "username": config['username'],
         "embeds": [
             {
-                "title": f"{emoji} {alert_name}",
-                "description": summary,
-                "color": color,
+                "title": "@@title@@",
+                "description": "@@description@@",
+                "color": "@@color@@",
                 "fields": [
-                    {"name": "Status", "value": status.upper(), "inline": True},
-                    {"name": "Severity", "value": severity.upper(), "inline": True},
-                    {"name": "Instance", "value": alert.get('labels', {}).get('instance', 'unknown'), "inline": True}
+                    {"name": "Status", "value": "@@status@@", "inline": True},
+                    {"name": "Severity", "value": "@@severity@@", "inline": True},
+                    {"name": "Instance", "value": "@@instance@@", "inline": True}
                 ],
                 "footer": {"text": "Prometheus Alert Manager"},
-                "timestamp": datetime.now().isoformat()
+                "timestamp": "@@timestamp@@"
             }
         ]
     }
-    
-    send_http_request(DISCORD_WEBHOOK_URL, payload)
 
-def send_discord_summary(alerts, external_url):
-    """Send alert summary to Discord"""
-    total_alerts = len(alerts)
-    critical_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'critical'])
-    warning_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'warning'])
-    
-    color = get_discord_color('critical' if critical_count > 0 else 'warning', 'firing')
-    
-    description = f"**{total_alerts} alerts active**\n"
-    description += f"🚨 {critical_count} critical\n"
-    description += f"⚠️ {warning_count} warning\n\n"
-    
-    for i, alert in enumerate(alerts[:5]):
-        alert_name = alert.get('labels', {}).get('alertname', 'Unknown')
-        severity = alert.get('labels', {}).get('severity', 'unknown')
-        emoji = get_alert_emoji(severity, alert.get('status', 'firing'))
-        description += f"{emoji} {alert_name} ({severity})\n"
-    
-    if len(alerts) > 5:
-        description += f"... and {len(alerts) - 5} more alerts"
-    
-    payload = {
-        "username": DISCORD_USERNAME,
-        "embeds": [
-            {
-                "title": "🚨 Prometheus Alert Summary",
-                "description": description,
-                "color": color,
-                "footer": {"text": "Prometheus Alert Manager"},
-                "timestamp": datetime.now().isoformat()
-            }
-        ]
+def discord_item_template(config):
+    return discord_alert_template(config)['embeds'][0]
+
+def discord_batch_template(config):
+    return {
+        "username": config['username'],
+        "content": "@@content@@",
+        "embeds": "@@items@@"
     }
-    
-    send_http_request(DISCORD_WEBHOOK_URL, payload)
 
-def send_teams_notifications(alerts, external_url):
-    """Send notifications to Microsoft Teams"""
-    if len(alerts) > 1:
-        send_teams_summary(alerts, external_url)
-    else:
-        send_teams_individual(alerts[0], external_url)
+def discord_digest_template(config):
+    return {
+        "username": config['username'],
+        "content": "@@text@@"
+    }
 
-def send_teams_individual(alert, external_url):
-    """Send individual alert to Microsoft Teams"""
-    alert_name = alert.get('labels', {}).get('alertname', 'Unknown Alert')
-    severity = alert.get('labels', {}).get('severity', 'unknown')
-    status = alert.get('status', 'unknown')
-    summary = alert.get('annotations', {}).get('summary', 'No summary available')
-    
-    theme_color = get_teams_color(severity, status)
-    emoji = get_alert_emoji(severity, status)
-    
-    payload = {
+def teams_alert_template(config):
+    return {
         "@type": "MessageCard",
         "@context": "http://schema.org/extensions",
-        "themeColor": theme_color,
-        "title": f"{emoji} Prometheus Alert",
-        "summary": f"{alert_name} - {severity}",
+        "themeColor": "@@color@@",
+        "title": "@@title@@",
+        "summary": "@@summary@@",
         "sections": [
             {
-                "activityTitle": alert_name,
-                "activitySubtitle": summary,
+                "activityTitle": "@@name@@",
+                "activitySubtitle": "@@subtitle@@",
                 "facts": [
-                    {"name": "Status", "value": status.upper()},
-                    {"name": "Severity", "value": severity.upper()},
-                    {"name": "Instance", "value": alert.get('labels', {}).get('instance', 'unknown')},
-                    {"name": "Job", "value": alert.get('labels', {}).get('job', 'unknown')}
+                    {"name": "Status", "value": "@@status@@"},
+                    {"name": "Severity", "value": "@@severity@@"},
+                    {"name": "Instance", "value": "@@instance@@"},
+                    {"name": "Job", "value": "@@job@@"}
                 ]
             }
         ]
     }
-    
-    send_http_request(TEAMS_WEBHOOK_URL, payload)
 
-def send_teams_summary(alerts, external_url):
-    """Send alert summary to Microsoft Teams"""
-    total_alerts = len(alerts)
-    critical_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'critical'])
-    warning_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'warning'])
-    
-    theme_color = get_teams_color('critical' if critical_count > 0 else 'warning', 'firing')
-    
-    facts = [
-        {"name": "Total Alerts", "value": str(total_alerts)},
-        {"name": "Critical", "value": str(critical_count)},
-        {"name": "Warning", "value": str(warning_count)}
-    ]
-    
-    payload = {
+def teams_item_template(config):
+    return teams_alert_template(config)['sections'][0]
+
+def teams_batch_template(config):
+    return {
         "@type": "MessageCard",
         "@context": "http://schema.org/extensions",
-        "themeColor": theme_color,
+        "themeColor": "@@color@@",
         "title": "🚨 Prometheus Alert Summary",
-        "summary": f"{total_alerts} alerts active",
-        "sections": [
-            {
-                "activityTitle": f"{total_alerts} Alerts Active",
-                "activitySubtitle": f"{critical_count} critical, {warning_count} warning",
-                "facts": facts
-            }
-        ]
+        "summary": "@@summary@@",
+        "text": "@@text@@",
+        "sections": "@@items@@"
     }
-    
-    send_http_request(TEAMS_WEBHOOK_URL, payload)
 
-def send_pagerduty_notifications(alerts, external_url):
-    """Send notifications to PagerDuty"""
-    for alert in alerts:
-        send_pagerduty_individual(alert, external_url)
+def teams_digest_template(config):
+    return {
+        "@type": "MessageCard",
+        "@context": "http://schema.org/extensions",
+        "themeColor": "0076d7",
+        "title": "📬 Prometheus Alert Digest",
+        "summary": "@@summary@@",
+        "text": "@@text@@"
+    }
 
-def send_pagerduty_individual(alert, external_url):
-    """Send individual alert to PagerDuty"""
-    alert_name = alert.get('labels', {}).get('alertname', 'Unknown Alert')
-    severity = alert.get('labels', {}).get('severity', 'unknown')
-    status = alert.get('status', 'unknown')
-    summary = alert.get('annotations', {}).get('summary', 'No summary available')
-    
-    # Map Prometheus severity to PagerDuty severity
-    pd_severity = PAGERDUTY_SEVERITY_MAP.get(severity, severity)
-    
-    # Determine event action
-    event_action = "resolve" if status == "resolved" else "trigger"
-    
-    payload = {
-        "routing_key": PAGERDUTY_INTEGRATION_KEY,
-        "event_action": event_action,
-        "dedup_key": f"{alert_name}_{alert.get('labels', {}).get('instance', 'unknown')}",
+def pagerduty_event_template(config):
+    return {
+        "routing_key": config['integration_key'],
+        "event_action": "@@event_action@@",
+        "dedup_key": "@@dedup_key@@",
         "payload": {
-            "summary": f"{alert_name}: {summary}",
-            "severity": pd_severity,
-            "source": alert.get('labels', {}).get('instance', 'unknown'),
-            "component": alert.get('labels', {}).get('job', 'prometheus'),
-            "group": alert.get('labels', {}).get('alertname', 'prometheus'),
+            "summary": "@@summary@@",
+            "severity": "@@severity@@",
+            "source": "@@source@@",
+            "component": "@@component@@",
+            "group": "@@group@@",
             "class": "prometheus-alert",
             "custom_details": {
-                "labels": alert.get('labels', {}),
-                "annotations": alert.get('annotations', {}),
-                "generator_url": alert.get('generatorURL', ''),
-                "external_url": external_url
+                "labels": "@@labels@@",
+                "annotations": "@@annotations@@",
+                "generator_url": "@@generator_url@@",
+                "external_url": "@@external_url@@"
             }
         }
     }
+
+# Payload skeletons per (channel, kind), compiled on first use
+CHANNEL_TEMPLATES = {
+    ('slack', 'alert'): slack_alert_template,
+    ('slack', 'item'): slack_item_template,
+    ('slack', 'batch'): slack_batch_template,
+    ('slack', 'digest'): slack_digest_template,
+    ('discord', 'alert'): discord_alert_template,
+    ('discord', 'item'): discord_item_template,
+    ('discord', 'batch'): discord_batch_template,
+    ('discord', 'digest'): discord_digest_template,
+    ('teams', 'alert'): teams_alert_template,
+    ('teams', 'item'): teams_item_template,
+    ('teams', 'batch'): teams_batch_template,
+    ('teams', 'digest'): teams_digest_template,
+    ('pagerduty', 'alert'): pagerduty_event_template,
+}
+
+@functools.lru_cache(maxsize=None)
+def get_payload_template(channel, kind):
+    """Compile a channel's payload template against its config once"""
+    return PayloadTemplate(CHANNEL_TEMPLATES[(channel, kind)](get_channel_config(channel)))
+
+def render_slack_alert(alert):
+    return get_payload_template('slack', 'alert').render(**slack_alert_values(alert))
+
+def render_slack_item(alert):
+    return get_payload_template('slack', 'item').render(**slack_alert_values(alert))
+
+def slack_alert_values(alert):
+    return {
+        'color': alert.style.slack_color,
+        'title': alert.title,
+        'text': alert.summary,
+        'status': alert.status.upper(),
+        'severity': alert.severity.upper(),
+        'instance': alert.instance,
+        'job': alert.job,
+        'ts': int(time.time())
+    }
+
+def render_slack_batch(alerts, items, part=1, parts=1):
+    return get_payload_template('slack', 'batch').render(
+        text=(f"*{len(alerts)} alerts* ({alerts.critical_count} critical, "
+              f"{alerts.warning_count} warning, {alerts.firing_count} firing)"
+              f"{format_transitions(alerts)}{format_part(part, parts)}"),
+        items=items
+    )
+
+def render_discord_alert(alert):
+    return get_payload_template('discord', 'alert').render(**discord_alert_values(alert))
+
+def render_discord_item(alert):
+    return get_payload_template('discord', 'item').render(**discord_alert_values(alert))
+
+def discord_alert_values(alert):
+    return {
+        'title': alert.title,
+        'description': alert.summary,
+        'color': alert.style.discord_color,
+        'status': alert.status.upper(),
+        'severity': alert.severity.upper(),
+        'instance': alert.instance,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def render_discord_batch(alerts, items, part=1, parts=1):
+    return get_payload_template('discord', 'batch').render(
+        content=(f"**{len(alerts)} alerts active** · 🚨 {alerts.critical_count} critical · "
+                 f"⚠️ {alerts.warning_count} warning{format_transitions(alerts)}{format_part(part, parts)}"),
+        items=items
+    )
+
+def render_teams_alert(alert):
+    return get_payload_template('teams', 'alert').render(**teams_alert_values(alert))
+
+def render_teams_item(alert):
+    return get_payload_template('teams', 'item').render(**teams_alert_values(alert))
+
+def teams_alert_values(alert):
+    return {
+        'color': alert.style.teams_color,
+        'title': f"{alert.style.emoji} Prometheus Alert",
+        'summary': f"{alert.name} - {alert.severity}",
+        'name': alert.name,
+        'subtitle': alert.summary,
+        'status': alert.status.upper(),
+        'severity': alert.severity.upper(),
+        'instance': alert.instance,
+        'job': alert.job
+    }
+
+def render_teams_batch(alerts, items, part=1, parts=1):
+    return get_payload_template('teams', 'batch').render(
+        color=get_teams_color('critical' if alerts.critical_count > 0 else 'warning', 'firing'),
+        summary=f"{len(alerts)} alerts active",
+        text=(f"**{len(alerts)} alerts**: {alerts.critical_count} critical, "
+              f"{alerts.warning_count} warning{format_transitions(alerts)}{format_part(part, parts)}"),
+        items=items
+    )
+
+def format_part(part, parts):
+    return f" (part {part}/{parts})" if parts > 1 else ""
+
+def format_transitions(alerts):
+    summary = alerts.transition_summary
+    return f" · {summary}" if summary else ""
+
+def render_pagerduty_event(alert, external_url):
+    """Events API v2 payload for an alert"""
+    severity_map = get_channel_config('pagerduty')['severity_map']
+    return get_payload_template('pagerduty', 'alert').render(
+        event_action="resolve" if alert.status == "resolved" else "trigger",
+        dedup_key=get_pagerduty_dedup_key(alert),
+        summary=f"{alert.name}: {alert.summary}",
+        severity=severity_map.get(alert.severity, alert.severity),
+        source=alert.instance,
+        component=alert.labels.get('job', 'prometheus'),
+        group=alert.labels.get('alertname', 'prometheus'),
+        labels=alert.labels,
+        annotations=alert.annotations,
+        generator_url=alert.raw.get('generatorURL', ''),
+        external_url=external_url
+    )
+
+class HTTPDeliveryError(Exception):
+    """Raised when a webhook POST still fails after all retries"""
+    
+    def __init__(self, message, status=None, attempts=None):
+        super().__init__(message)
+        self.status = status
+        self.attempts = attempts or []
+
+class BackpressureGate:
+    """Shared pause gate so a 429 seen by one worker holds back all of them"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+    
+    def wait(self, max_seconds=float('inf')):
+        """Sleep out the pause; raise DeadlineExceeded rather than sleep past max_seconds"""
+        delay = self._resume_at - time.monotonic()
+        if delay > max_seconds:
+            raise DeadlineExceeded(f"backpressure pause of {delay:.1f}s exceeds the {max_seconds:.1f}s left")
+        if delay > 0:
+            time.sleep(delay)
+    
+    def pause(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+def send_http_request(url, payload, max_attempts=None, budget_seconds=None, gate=None, attempt_log=None,
+                      channel=None):
+    """
+    Send HTTP POST request, retrying transient failures.
+    Connection errors and 408/425/429/5xx responses are retried with
+    exponential backoff and full jitter (or the server's Retry-After)
+    until max_attempts, the time budget or the channel's deadline is
+    used up; the deadline also caps each attempt's timeouts. A final
+    non-2xx response raises HTTPDeliveryError. Per-attempt status and
+    latency are appended to attempt_log when one is given, and recorded
+    as metrics under channel. payload may be a dict or already
+    serialized JSON (str or bytes); urllib3 is always handed bytes.
+    """
+    if max_attempts is None:
+        max_attempts = HTTP_MAX_ATTEMPTS
+    if budget_seconds is None:
+        budget_seconds = HTTP_RETRY_BUDGET_SECONDS
+    if attempt_log is None:
+        attempt_log = []
+    
+    from urllib3.exceptions import HTTPError
+    
+    if not get_rate_limiter().try_acquire(url):
+        raise RateLimitExceeded(f"Rate limit reached for {url[:50]}...")
+    
+    if isinstance(payload, bytes):
+        body = payload
+    elif isinstance(payload, str):
+        body = payload.encode('utf-8')
+    else:
+        body = get_json_codec().dumps_bytes(payload)
+    started = time.monotonic()
+    
+    for attempt in range(1, max_attempts + 1):
+        if gate:
+            gate.wait(min(budget_seconds - (time.monotonic() - started), scheduler.time_left(channel)))
+        
+        attempt_started = time.monotonic()
+        time_left = scheduler.time_left(channel)
+        response = None
+        error = None
+        try:
+            response = get_http_transport().request(
+                'POST',
+                url,
+                body=body,
+                headers={'Content-Type': 'application/json'},
+                timeout=max(time_left, 0.1) if time_left < float('inf') else None
+            )
+        except HTTPError as e:
+            error = e
+        
+        latency_ms = round((time.monotonic() - attempt_started) * 1000, 1)
+        status = response.status if response is not None else None
+        attempt_log.append({'attempt': attempt, 'status': status, 'latency_ms': latency_ms})
+        metrics.record('SendLatency', latency_ms, 'Milliseconds', channel)
+        
+        if status is not None and 200 <= status < 300:
+            print(f"HTTP request sent to {url[:50]}... - Status: {status} "
+                  f"(attempt {attempt}, {latency_ms}ms)")
+            record_delivery(channel, body, attempt)
+            return response
+        
+        reason = f"Status: {status}" if status is not None else f"Error: {str(error)}"
+        retryable = status is None or status in RETRYABLE_STATUSES
+        if not retryable or attempt == max_attempts:
+            break
+        
+        delay = get_backoff_delay(attempt, response)
+        if time.monotonic() - started + delay > budget_seconds:
+            print(f"Retry budget of {budget_seconds:g}s exhausted for {url[:50]}...")
+            break
+        if delay >= scheduler.time_left(channel):
+            print(f"Deadline reached for {url[:50]}..., not retrying")
+            break
+        # Only hold back the other workers for a retry that will happen; the
+        # checks above keep the pause inside the retry budget and the deadline
+        if status == 429 and gate:
+            gate.pause(delay)
+        print(f"HTTP request to {url[:50]}... failed ({reason}, {latency_ms}ms), "
+              f"retrying in {delay:.2f}s")
+        time.sleep(delay)
     
-    send_http_request("https://events.pagerduty.com/v2/enqueue", payload)
+    print(f"Error sending HTTP request to {url[:50]}... - {reason} after {len(attempt_log)} attempt(s)")
+    record_delivery(channel, body, attempt, failed=True)
+    raise HTTPDeliveryError(
+        f"POST {url[:50]}... failed after {len(attempt_log)} attempt(s): {reason}",
+        status=status,
+        attempts=attempt_log
+    )
 
-def send_http_request(url, payload):
-    """Send HTTP POST request"""
+def record_delivery(channel, body, attempts, failed=False):
+    """Per-request metrics once a delivery has succeeded or given up"""
+    metrics.record('Requests', 1, channel=channel)
+    metrics.record('Retries', attempts - 1, channel=channel)
+    metrics.record('PayloadBytes', len(body), 'Bytes', channel)
+    if failed:
+        metrics.record('DeliveryErrors', 1, channel=channel)
+
+def get_backoff_delay(attempt, response=None):
+    """Exponential backoff with full jitter, overridden by Retry-After"""
+    ceiling = min(HTTP_RETRY_MAX_DELAY, HTTP_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    jittered = random.uniform(0, ceiling)
+    if response is None:
+        return jittered
+    return get_retry_after(response, default=jittered)
+
+def get_retry_after(response, default=1.0):
+    """Read a Retry-After header (seconds or HTTP date) from a response"""
+    value = response.headers.get('Retry-After') if response.headers else None
+    if not value:
+        return default
     try:
-        response = http.request(
-            'POST',
-            url,
-            body=json.dumps(payload),
-            headers={'Content-Type': 'application/json'}
-        )
-        print(f"HTTP request sent to {url[:50]}... - Status: {response.status}")
-        return response
-    except Exception as e:
-        print(f"Error sending HTTP request: {str(e)}")
-        raise
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
 
 def send_sns_message(subject, message):
     """Send message to SNS topic"""
     try:
-        response = sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
+        response = get_sns_client(scheduler.time_left('email')).publish(
+            TopicArn=get_channel_config('email')['topic_arn'],
             Subject=subject,
             Message=message
         )
@@ -449,91 +2824,40 @@ def send_sns_message(subject, message):
         print(f"Error sending SNS message: {str(e)}")
         raise
 
-def get_alert_emoji(severity, status):
-    """Get appropriate emoji for alert"""
-    if status == 'resolved':
-        return '✅'
-    elif severity == 'critical':
-        return '🚨'
-    elif severity == 'warning':
-        return '⚠️'
-    elif severity == 'info':
-        return 'ℹ️'
-    else:
-        return '🔔'
-
-def get_slack_color(severity, status):
-    """Get Slack attachment color"""
-    if status == 'resolved':
-        return 'good'
-    elif severity == 'critical':
-        return 'danger'
-    elif severity == 'warning':
-        return 'warning'
-    else:
-        return '#808080'
-
-def get_discord_color(severity, status):
-    """Get Discord embed color (decimal)"""
-    if status == 'resolved':
-        return 3066993  # Green
-    elif severity == 'critical':
-        return 15158332  # Red
-    elif severity == 'warning':
-        return 16776960  # Yellow
-    else:
-        return 8421504  # Gray
-
 def get_teams_color(severity, status):
     """Get Teams theme color (hex)"""
-    if status == 'resolved':
-        return '2eb886'  # Green
-    elif severity == 'critical':
-        return 'd63031'  # Red
-    elif severity == 'warning':
-        return 'fdcb6e'  # Yellow
-    else:
-        return '636e72'  # Gray
+    return get_alert_style(severity, status).teams_color
 
 def format_email_alert(alert, external_url):
     """Format individual alert for email"""
-    alert_name = alert.get('labels', {}).get('alertname', 'Unknown Alert')
-    severity = alert.get('labels', {}).get('severity', 'unknown')
-    status = alert.get('status', 'unknown')
-    instance = alert.get('labels', {}).get('instance', 'unknown')
-    job = alert.get('labels', {}).get('job', 'unknown')
-    
-    summary = alert.get('annotations', {}).get('summary', 'No summary available')
-    description = alert.get('annotations', {}).get('description', 'No description available')
+    starts_at = format_timestamp(alert.raw.get('startsAt', ''))
+    ends_at = format_timestamp(alert.raw.get('endsAt', '')) if alert.raw.get('endsAt') else 'Ongoing'
     
-    starts_at = format_timestamp(alert.get('startsAt', ''))
-    ends_at = format_timestamp(alert.get('endsAt', '')) if alert.get('endsAt') else 'Ongoing'
-    
-    emoji = get_alert_emoji(severity, status)
+    emoji = alert.style.emoji
     
     return f"""
 {emoji} PROMETHEUS ALERT {emoji}
 
-Alert: {alert_name}
-Status: {status.upper()}
-Severity: {severity.upper()}
-Instance: {instance}
-Job: {job}
+Alert: {alert.name}
+Status: {alert.status.upper()}
+Severity: {alert.severity.upper()}
+Instance: {alert.instance}
+Job: {alert.job}
 
-Summary: {summary}
-Description: {description}
+Summary: {alert.summary}
+Description: {alert.description}
 
 Timeline:
 Started: {starts_at}
 Ended: {ends_at}
 
 Labels:
-{format_labels(alert.get('labels', {}))}
+{format_labels(alert.labels)}
 
 Annotations:
-{format_annotations(alert.get('annotations', {}))}
+{format_annotations(alert.annotations)}
 
-Generator URL: {alert.get('generatorURL', 'N/A')}
+Generator URL: {alert.raw.get('generatorURL', 'N/A')}
 External URL: {external_url}
 
 ---
@@ -541,48 +2865,98 @@ This alert was generated by Amazon Managed Prometheus
 Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}
 """
 
-def format_email_summary(alerts, external_url):
-    """Format alert summary for email"""
-    total_alerts = len(alerts)
-    critical_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'critical'])
-    warning_count = len([a for a in alerts if a.get('labels', {}).get('severity') == 'warning'])
-    firing_count = len([a for a in alerts if a.get('status') == 'firing'])
-    resolved_count = len([a for a in alerts if a.get('status') == 'resolved'])
+class EmailBodyWriter:
+    """Text buffer that tracks its UTF-8 size as chunks are written"""
     
-    message_body = f"""
-🚨 PROMETHEUS ALERT SUMMARY 🚨
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._buffer = io.StringIO()
+    
+    def fits(self, text, reserve=0):
+        return self.size + utf8_len(text) + reserve <= self.max_bytes
+    
+    def write(self, text):
+        self._buffer.write(text)
+        self.size += utf8_len(text)
+    
+    def getvalue(self):
+        return self._buffer.getvalue()
 
-Total Alerts: {total_alerts}
-├── Critical: {critical_count}
-├── Warning: {warning_count}
-├── Firing: {firing_count}
-└── Resolved: {resolved_count}
+def render_email_summary(alerts, external_url, max_bytes=None, split=False):
+    """
+    Render the email summary into one or more message bodies of at
+    most max_bytes. Alerts are streamed into the buffer; once the next
+    one would not fit, the body either ends with an "N more alerts"
+    line or, with split=True, continues in a new numbered message.
+    """
+    if max_bytes is None:
+        max_bytes = SNS_MAX_MESSAGE_BYTES
+    
+    changes = f"\nChanges: {alerts.transition_summary}\n" if alerts.transition_summary else ""
+    header = f"""
+🚨 PROMETHEUS ALERT SUMMARY 🚨
 
+Total Alerts: {len(alerts)}
+├── Critical: {alerts.critical_count}
+├── Warning: {alerts.warning_count}
+├── Firing: {alerts.firing_count}
+└── Resolved: {alerts.resolved_count}
+{changes}
 Individual Alerts:
 """
-    
-    for i, alert in enumerate(alerts, 1):
-        alert_name = alert.get('labels', {}).get('alertname', 'Unknown')
-        severity = alert.get('labels', {}).get('severity', 'unknown')
-        status = alert.get('status', 'unknown')
-        instance = alert.get('labels', {}).get('instance', 'unknown')
-        summary = alert.get('annotations', {}).get('summary', 'No summary')
-        
-        emoji = get_alert_emoji(severity, status)
-        message_body += f"""
-{i}. {emoji} {alert_name}
-   Status: {status.upper()} | Severity: {severity.upper()}
-   Instance: {instance}
-   Summary: {summary}
-"""
-    
-    message_body += f"""
+    footer = f"""
 ---
 External URL: {external_url}
 Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}
 """
+    more_line = "\n... and {} more alerts (not shown, message size limit reached)\n"
+    reserve = utf8_len(footer) + utf8_len(more_line.format(len(alerts)))
+    
+    messages = []
+    writer = EmailBodyWriter(max_bytes)
+    writer.write(truncate_utf8(header, max_bytes - reserve))
+    entries_in_part = 0
+    
+    for i, alert in enumerate(alerts, 1):
+        emoji = alert.style.emoji
+        entry = f"""
+{i}. {emoji} {alert.name}
+   Status: {alert.status.upper()} | Severity: {alert.severity.upper()}
+   Instance: {alert.instance}
+   Summary: {alert.summary}
+"""
+        if writer.fits(entry, reserve) or entries_in_part == 0:
+            # A single oversized alert is cut down rather than skipped
+            writer.write(truncate_utf8(entry, max_bytes - writer.size - reserve))
+            entries_in_part += 1
+            continue
+        
+        if not split:
+            writer.write(more_line.format(len(alerts) - i + 1))
+            break
+        
+        writer.write(footer)
+        messages.append(writer.getvalue())
+        writer = EmailBodyWriter(max_bytes)
+        writer.write(f"\n🚨 PROMETHEUS ALERT SUMMARY (continued, part {len(messages) + 1}) 🚨\n")
+        writer.write(truncate_utf8(entry, max_bytes - writer.size - reserve))
+        entries_in_part = 1
     
-    return message_body
+    writer.write(footer)
+    messages.append(writer.getvalue())
+    return messages
+
+def utf8_len(text):
+    """Size of text in bytes once UTF-8 encoded"""
+    return len(text.encode('utf-8'))
+
+def truncate_utf8(text, max_bytes):
+    """Cut text to at most max_bytes of UTF-8 without splitting a character"""
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max(0, max_bytes)].decode('utf-8', errors='ignore')
 
 def format_timestamp(timestamp_str):
     """Format timestamp string to readable format"""
@@ -600,19 +2974,11 @@ def format_labels(labels):
     if not labels:
         return '  (none)'
     
-    formatted = ""
-    for key, value in labels.items():
-        formatted += f"  {key}: {value}\n"
-    
-    return formatted.rstrip()
+    return "\n".join(f"  {key}: {value}" for key, value in labels.items()).rstrip()
 
 def format_annotations(annotations):
     """Format annotations dictionary for display"""
     if not annotations:
         return '  (none)'
     
-    formatted = ""
-    for key, value in annotations.items():
-        formatted += f"  {key}: {value}\n"
-    
-    return formatted.rstrip()
\ No newline at end of file
+    return "\n".join(f"  {key}: {value}" for key, value in annotations.items()).rstrip()
\ No newline at end of file
@@ -0,0 +1,358 @@
+"""
+Offline checks for prometheus-rules.yml before it is deployed with
+aws_prometheus_rule_group_namespace.
+
+For every alerting rule it extracts the labels the expression groups
+by and the `for:` duration, estimates how many alerts one evaluation
+can produce (from a series-cardinality file) and how fast they reach
+the webhook Lambda through Alertmanager, and flags rules that would
+exceed the Lambda's throughput budget. It also lints the rules for
+problems the webhook would surface badly (no severity, no summary,
+template labels dropped by aggregation). Requires PyYAML.
+
+Usage:
+    python rules_lint.py [rules.yml] [--cardinality series.json]
+                         [--max-alerts-per-s N] [--lambda-timeout SECONDS]
+
+Exits with 1 when any rule has an error.
+
+A cardinality file (JSON, or YAML) gives series per metric and
+distinct values per label; anything missing is assumed to have one
+series per scrape target (--instances, and --jobs for `job`):
+
+    {"metrics": {"up": 1200, "node_cpu_seconds_total": 19200},
+     "labels": {"instance": 1200, "job": 12}}
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+RULES_FILE = os.path.join(MODULE_DIR, 'prometheus-rules.yml')
+ALERTMANAGER_FILE = os.path.join(MODULE_DIR, 'alertmanager.yml')
+
+GROUPING = re.compile(r'\b(by|without)\s*\(([^)]*)\)')
+TEMPLATE_LABEL = re.compile(r'{{\s*\$labels\.(\w+)\s*}}')
+DURATION = re.compile(r'^(?:\d+(?:ms|s|m|h|d|w|y))+$')
+DURATION_PART = re.compile(r'(\d+)(ms|s|m|h|d|w|y)')
+DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'y': 31536000}
+
+# Stripped from expressions before metric names are picked out
+STRINGS = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+MATCHERS = re.compile(r'{[^}]*}')
+RANGES = re.compile(r'\[[^\]]*\]')
+MODIFIERS = re.compile(r'\b(?:by|without|on|ignoring|group_left|group_right)\s*\([^)]*\)')
+IDENTIFIER = re.compile(r'(?<![\w.])([a-zA-Z_:][\w:]*)(?!\s*\(|[\w:])')
+KEYWORDS = {
+    'and', 'or', 'unless', 'by', 'without', 'on', 'ignoring', 'group_left', 'group_right',
+    'bool', 'offset', 'inf', 'nan', 'Inf', 'NaN'
+}
+
+# Alertmanager's own defaults, used when alertmanager.yml does not set them
+ALERTMANAGER_DEFAULTS = {'group_wait': '30s', 'group_interval': '5m'}
+# Amazon Managed Prometheus evaluates rule groups every minute unless `interval:` is set
+DEFAULT_EVALUATION_INTERVAL = '1m'
+
+
+def load_yaml(path):
+    """Parse a YAML file; PyYAML is imported here so JSON inputs do not need it"""
+    import yaml
+
+    with open(path, encoding='utf-8') as f:
+        return yaml.safe_load(f)
+
+
+def load_rule_groups(path=RULES_FILE):
+    """The `groups` of a Prometheus rules file"""
+    document = load_yaml(path) or {}
+    return document.get('groups') or []
+
+
+def load_alert_rules(path=RULES_FILE):
+    """Alerting rules (not recording rules) from a Prometheus rules file"""
+    return [rule for group in load_rule_groups(path) for rule in group.get('rules') or []
+            if 'alert' in rule]
+
+
+def grouping_labels(expr):
+    """
+    Labels an expression's result keeps, from its by (...) clauses, and
+    whether they are known: a without (...) clause or no aggregation
+    keeps whatever labels the series have.
+    """
+    names = set()
+    exhaustive = True
+    for keyword, clause in GROUPING.findall(expr):
+        if keyword == 'without':
+            exhaustive = False
+        else:
+            names.update(name.strip() for name in clause.split(','))
+    names -= {'', 'le'}  # histogram_quantile() consumes le
+    return sorted(names), exhaustive and bool(names)
+
+
+def series_labels(rule):
+    """Labels that tell a rule's alerts apart: its by (...) labels, else instance and job"""
+    names, exhaustive = grouping_labels(rule['expr'])
+    return names if exhaustive else ['instance', 'job']
+
+
+def metric_names(expr):
+    """Metric names selected by an expression, in order of appearance"""
+    text = STRINGS.sub('""', expr)
+    text = MATCHERS.sub(' ', text)
+    text = RANGES.sub(' ', text)
+    text = MODIFIERS.sub(' ', text)
+    names = []
+    for name in IDENTIFIER.findall(text):
+        if name not in KEYWORDS and name not in names:
+            names.append(name)
+    return names
+
+
+def parse_duration(value):
+    """Seconds in a Prometheus duration such as '5m' or '1h30m'"""
+    value = str(value).strip()
+    if not DURATION.match(value):
+        raise ValueError(f"Invalid duration: {value!r}")
+    return sum(int(count) * DURATION_SECONDS[unit] for count, unit in DURATION_PART.findall(value))
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    parts = []
+    for unit, size in (('h', 3600), ('m', 60), ('s', 1)):
+        if seconds >= size or (unit == 's' and not parts):
+            parts.append(f"{seconds // size}{unit}")
+            seconds %= size
+    return ''.join(parts)
+
+
+def unbalanced(expr):
+    """The first bracket that is not closed or opened properly, or None"""
+    pairs = {')': '(', ']': '[', '}': '{'}
+    stack = []
+    for char in STRINGS.sub('""', expr):
+        if char in '([{':
+            stack.append(char)
+        elif char in pairs:
+            if not stack or stack.pop() != pairs[char]:
+                return char
+    return stack[-1] if stack else None
+
+
+class SeriesCardinality:
+    """
+    Series per metric and distinct values per label. Anything not
+    listed is assumed to have `default_series` (one per scrape target).
+    """
+
+    def __init__(self, metrics=None, labels=None, default_series=50):
+        self.metrics = dict(metrics or {})
+        self.labels = dict(labels or {})
+        self.default_series = default_series
+        self.assumed = set()
+
+    @classmethod
+    def load(cls, path, default_series=50):
+        if path.endswith('.json'):
+            with open(path, encoding='utf-8') as f:
+                document = json.load(f)
+        else:
+            document = load_yaml(path)
+        return cls(document.get('metrics'), document.get('labels'), default_series)
+
+    def series(self, metric):
+        if metric not in self.metrics:
+            self.assumed.add(metric)
+        return self.metrics.get(metric, self.default_series)
+
+    def values(self, label):
+        if label not in self.labels:
+            self.assumed.add(label)
+        return self.labels.get(label, self.default_series)
+
+
+def estimate_alerts(expr, cardinality):
+    """
+    Upper bound on the alerts one evaluation can produce: the product
+    of the grouping labels' values, capped by the series of the
+    smallest metric the expression selects (label matchers are ignored,
+    so this errs high).
+    """
+    labels, exhaustive = grouping_labels(expr)
+    metrics = metric_names(expr)
+    bound = min((cardinality.series(metric) for metric in metrics), default=1)
+    if exhaustive:
+        return min(math.prod(cardinality.values(label) for label in labels), bound)
+    return bound
+
+
+def load_alertmanager_timing(path=ALERTMANAGER_FILE):
+    """group_wait and group_interval (seconds) of the root route in alertmanager.yml"""
+    route = {}
+    if path and os.path.exists(path):
+        document = load_yaml(path) or {}
+        config = document.get('alertmanager_config', document)
+        if isinstance(config, str):
+            import yaml
+
+            config = yaml.safe_load(config) or {}
+        route = config.get('route') or {}
+    return {key: parse_duration(route.get(key) or default) for key, default in ALERTMANAGER_DEFAULTS.items()}
+
+
+class RuleReport:
+    """Estimates and findings for one alerting rule"""
+
+    def __init__(self, group, rule):
+        self.group = group
+        self.rule = rule
+        self.name = rule.get('alert', '?')
+        self.expr = str(rule.get('expr', ''))
+        self.labels, self.exhaustive = grouping_labels(self.expr)
+        self.for_seconds = 0.0
+        self.alerts = 0
+        self.alerts_per_s = 0.0
+        self.first_notification = 0.0
+        self.findings = []
+
+    def error(self, message):
+        self.findings.append(('error', message))
+
+    def warn(self, message):
+        self.findings.append(('warning', message))
+
+    @property
+    def failed(self):
+        return any(level == 'error' for level, _ in self.findings)
+
+
+def lint_rules(groups, cardinality, timing, max_alerts_per_s=50.0, lambda_timeout=60.0):
+    """Check every alerting rule in the groups; returns RuleReports in file order"""
+    reports = []
+    seen = set()
+    for group in groups:
+        try:
+            interval = parse_duration(group.get('interval') or DEFAULT_EVALUATION_INTERVAL)
+        except ValueError as e:
+            interval = parse_duration(DEFAULT_EVALUATION_INTERVAL)
+            print(f"group {group.get('name')}: {e}; assuming {DEFAULT_EVALUATION_INTERVAL}")
+        for rule in group.get('rules') or []:
+            if 'alert' not in rule:
+                continue
+            report = RuleReport(group.get('name'), rule)
+            reports.append(report)
+            check_rule(report, seen)
+            if not report.expr:
+                continue
+
+            report.alerts = estimate_alerts(report.expr, cardinality)
+            report.alerts_per_s = report.alerts / max(interval, timing['group_interval'])
+            report.first_notification = report.for_seconds + interval + timing['group_wait']
+            if report.alerts_per_s > max_alerts_per_s:
+                report.error(f"up to {report.alerts} alerts every {format_duration(timing['group_interval'])} "
+                             f"is {report.alerts_per_s:.0f} alerts/s, over the budget of {max_alerts_per_s:g}")
+            if report.alerts / max_alerts_per_s > lambda_timeout:
+                report.error(f"one payload of {report.alerts} alerts needs ~{report.alerts / max_alerts_per_s:.0f}s "
+                             f"at {max_alerts_per_s:g} alerts/s, longer than the {lambda_timeout:g}s Lambda timeout")
+            if report.alerts > 1 and 'for' not in report.rule:
+                report.warn(f"no `for:`, so up to {report.alerts} alerts can fire and resolve on every flap")
+    return reports
+
+
+def check_rule(report, seen):
+    """Structural checks that need no cardinality data"""
+    rule = report.rule
+    if report.name in seen:
+        report.warn("duplicate alert name; Alertmanager groups both rules' alerts together")
+    seen.add(report.name)
+    if not report.expr:
+        report.error("missing expr")
+        return
+    bracket = unbalanced(report.expr)
+    if bracket:
+        report.error(f"unbalanced {bracket!r} in expr")
+    if 'for' in rule:
+        try:
+            report.for_seconds = parse_duration(rule['for'])
+        except ValueError as e:
+            report.error(str(e))
+    if not (rule.get('labels') or {}).get('severity'):
+        report.warn("no severity label; the webhook shows it as 'unknown'")
+    annotations = rule.get('annotations') or {}
+    if not annotations.get('summary'):
+        report.warn("no summary annotation; notifications show 'No summary available'")
+    if report.exhaustive:
+        kept = set(report.labels) | set(rule.get('labels') or {})
+        dropped = sorted({
+            label for text in annotations.values() for label in TEMPLATE_LABEL.findall(str(text))
+            if label not in kept
+        })
+        if dropped:
+            report.warn(f"annotations use {', '.join('$labels.' + label for label in dropped)}, "
+                        f"which by ({', '.join(report.labels)}) drops; they render empty")
+
+
+def print_reports(reports, cardinality, timing, max_alerts_per_s):
+    print(f"Alertmanager: group_wait {format_duration(timing['group_wait'])}, "
+          f"group_interval {format_duration(timing['group_interval'])}; "
+          f"budget {max_alerts_per_s:g} alerts/s")
+    print(f"{'rule':<24} {'for':>6} {'grouped by':<18} {'alerts/eval':>11} {'alerts/s':>9} {'first notify':>13}")
+    for report in reports:
+        grouped = ','.join(report.labels) if report.exhaustive else '(series)'
+        print(f"{report.name:<24} {format_duration(report.for_seconds) if report.for_seconds else '-':>6} "
+              f"{grouped:<18} {report.alerts:>11} {report.alerts_per_s:>9.1f} "
+              f"{format_duration(report.first_notification):>13}")
+    if cardinality.assumed:
+        print(f"\nAssumed {cardinality.default_series} series/values for: {', '.join(sorted(cardinality.assumed))}")
+    findings = [(report, level, message) for report in reports for level, message in report.findings]
+    if findings:
+        print()
+    for report, level, message in findings:
+        print(f"{level.upper():<8} {report.group}/{report.name}: {message}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog='rules_lint.py',
+        description='Lint Prometheus alerting rules and estimate the alert load they put on the webhook'
+    )
+    parser.add_argument('rules', nargs='?', default=RULES_FILE, help='rules file (default: prometheus-rules.yml)')
+    parser.add_argument('--cardinality', help='series per metric and values per label (JSON or YAML)')
+    parser.add_argument('--instances', type=int, default=50,
+                        help='series assumed for metrics and labels missing from --cardinality (default: 50)')
+    parser.add_argument('--jobs', type=int, default=5,
+                        help='values of `job` unless --cardinality lists it (default: 5)')
+    parser.add_argument('--alertmanager', default=ALERTMANAGER_FILE,
+                        help='Alertmanager config for group_wait/group_interval (default: alertmanager.yml)')
+    parser.add_argument('--max-alerts-per-s', type=float, default=50.0,
+                        help='alerts/s the webhook Lambda can deliver (default: 50; measure with '
+                             'bench_webhook.py loadtest)')
+    parser.add_argument('--lambda-timeout', type=float, default=60.0,
+                        help='webhook Lambda timeout in seconds (default: 60, as in notification.tf)')
+    args = parser.parse_args(argv)
+
+    if args.cardinality:
+        cardinality = SeriesCardinality.load(args.cardinality, args.instances)
+    else:
+        cardinality = SeriesCardinality(default_series=args.instances)
+    cardinality.labels.setdefault('instance', args.instances)
+    cardinality.labels.setdefault('job', args.jobs)
+    timing = load_alertmanager_timing(args.alertmanager)
+    reports = lint_rules(load_rule_groups(args.rules), cardinality, timing,
+                         args.max_alerts_per_s, args.lambda_timeout)
+    print_reports(reports, cardinality, timing, args.max_alerts_per_s)
+    failed = [report.name for report in reports if report.failed]
+    if failed:
+        print(f"\n{len(failed)} rule(s) failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,233 @@
+"""
+Tests for the webhook Lambda (lambda_webhook.py): deadline budgeting,
+EMF metrics, the spill queue and per-channel dedup.
+
+Channels post to the in-process stub servers from bench_webhook.py, so
+no AWS account or real webhook is needed.
+
+Usage:
+    cd module && python -m pytest -q test_lambda_webhook.py
+"""
+
+import json
+import os
+
+import pytest
+
+from bench_webhook import StubContext, StubServer, make_alerts
+
+import lambda_webhook
+
+
+@pytest.fixture
+def webhook(monkeypatch, tmp_path):
+    """lambda_webhook with every channel off and fresh warm-container state"""
+    for name in ('EMAIL', 'SLACK', 'DISCORD', 'TEAMS', 'PAGERDUTY'):
+        monkeypatch.setattr(lambda_webhook, f'{name}_ENABLED', False)
+    monkeypatch.setattr(lambda_webhook, 'DEDUP_ENABLED', False)
+    monkeypatch.setattr(lambda_webhook, 'DEDUP_TABLE_NAME', '')
+    monkeypatch.setattr(lambda_webhook, 'DEDUP_STATE_FILE', '')
+    monkeypatch.setattr(lambda_webhook, 'SPILL_ENABLED', False)
+    monkeypatch.setattr(lambda_webhook, 'SPILL_QUEUE_URL', '')
+    monkeypatch.setattr(lambda_webhook, 'SPILL_DIR', str(tmp_path / 'spill'))
+    monkeypatch.setattr(lambda_webhook, 'HTTP_RETRY_BASE_DELAY', 0.01)
+    for name in ('dedup_cache', 'outbound_queue', 'rate_limiter', 'http_transport'):
+        monkeypatch.setattr(lambda_webhook, name, None)
+    monkeypatch.setattr(lambda_webhook, 'coalesced_alerts', {})
+    lambda_webhook.get_channel_config.cache_clear()
+    yield lambda_webhook
+    lambda_webhook.get_channel_config.cache_clear()
+    lambda_webhook.scheduler.start(None)
+
+
+def enable(monkeypatch, **channels):
+    """Turn channels on, pointing each at a URL: enable(monkeypatch, slack=url)"""
+    for name, url in channels.items():
+        monkeypatch.setattr(lambda_webhook, f'{name.upper()}_ENABLED', True)
+        if name == 'pagerduty':
+            monkeypatch.setenv('PAGERDUTY_INTEGRATION_KEY', 'test')
+            monkeypatch.setenv('PAGERDUTY_EVENTS_URL', url)
+        else:
+            monkeypatch.setenv(f'{name.upper()}_WEBHOOK_URL', url)
+            monkeypatch.setenv(f'{name.upper()}_RATE_LIMIT', '0')
+    lambda_webhook.get_channel_config.cache_clear()
+
+
+def invoke(alerts, context=None):
+    response = lambda_webhook.handler({'alerts': alerts}, context)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+
+def spilled_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+# Deadline budgeting
+
+def test_scheduler_shares_budget_by_priority(webhook):
+    now = [100.0]
+    clock = lambda: now[0]  # noqa: E731
+    scheduler = webhook.DeadlineScheduler(1.5, clock=clock)
+    scheduler.start(StubContext(11.5, clock=clock))
+
+    assert scheduler.budget == 10.0
+    assert scheduler.time_left('pagerduty') == 10.0  # high
+    assert scheduler.time_left('slack') == 8.0  # normal
+    assert scheduler.time_left('email') == 5.0  # low
+
+    now[0] += 6
+    assert scheduler.expired('email')
+    assert not scheduler.expired('slack')
+    assert scheduler.time_left('pagerduty') == 4.0
+
+
+def test_scheduler_without_context_never_expires(webhook):
+    scheduler = webhook.DeadlineScheduler(1.5, clock=lambda: 0.0)
+    scheduler.start(None)
+    assert scheduler.time_left('email') == float('inf')
+    assert not scheduler.expired()
+    assert scheduler.stats() == {'budget_seconds': None, 'deferred': {}}
+
+
+# EMF metrics
+
+def test_metrics_flush_writes_parseable_emf(webhook, capsys):
+    recorder = webhook.MetricsRecorder('Test', clock=lambda: 1.5)
+    recorder.record('AlertsProcessed', 3)
+    for latency in range(150):
+        recorder.record('SendLatency', latency, 'Milliseconds', channel='slack')
+    recorder.flush()
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    invocation = [line for line in lines if 'Channel' not in line]
+    slack = [line for line in lines if line.get('Channel') == 'slack']
+    assert invocation[0]['AlertsProcessed'] == 3
+    assert invocation[0]['_aws']['Timestamp'] == 1500
+    assert invocation[0]['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [[]]
+    # At most 100 values per metric per line
+    assert [len(line['SendLatency']) for line in slack] == [100, 50]
+    assert slack[0]['_aws']['CloudWatchMetrics'][0] == {
+        'Namespace': 'Test',
+        'Dimensions': [['Channel']],
+        'Metrics': [{'Name': 'SendLatency', 'Unit': 'Milliseconds'}]
+    }
+
+
+def test_handler_emits_invocation_metrics(webhook, capsys):
+    invoke(make_alerts(4))
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()
+                 if line.startswith('{"_aws"')]
+    assert any(document.get('AlertsProcessed') == 4 for document in documents)
+
+
+# Spill queue
+
+def test_rate_limited_replays_stay_queued(webhook, tmp_path):
+    store = webhook.FileSpillStore(str(tmp_path), max_replays=2)
+    for index in range(7):
+        store.push('slack', {'text': index})
+    sent = []
+
+    def send(destination, payload):
+        if len(sent) == 3:
+            raise webhook.RateLimitExceeded('bucket empty')
+        sent.append(payload['text'])
+
+    assert store.drain(send, ['slack'], 50) == {'slack'}
+    assert sent == [0, 1, 2]
+    remaining = spilled_lines(store.path('slack'))
+    assert [entry['payload']['text'] for entry in remaining] == [3, 4, 5, 6]
+    assert all(entry['replays'] == 0 for entry in remaining)
+    assert not os.path.exists(store.dead_letter_path('slack'))
+
+
+def test_replay_cap_dead_letters_and_unblocks(webhook, tmp_path):
+    store = webhook.FileSpillStore(str(tmp_path), max_replays=2)
+    store.push('slack', {'text': 'poison'})
+    store.push('slack', {'text': 'fine'})
+    sent = []
+
+    def send(destination, payload):
+        if payload['text'] == 'poison':
+            raise webhook.HTTPDeliveryError('503', status=503)
+        sent.append(payload['text'])
+
+    assert store.drain(send, ['slack'], 50) == {'slack'}
+    assert sent == []
+    assert store.drain(send, ['slack'], 50) == set()
+    assert sent == ['fine']
+    assert [entry['payload']['text'] for entry in spilled_lines(store.dead_letter_path('slack'))] == ['poison']
+    assert store.dead_lettered['slack'] == 1
+
+
+def test_only_retryable_failures_are_spilled(webhook, tmp_path):
+    queue = webhook.OutboundQueue(webhook.FileSpillStore(str(tmp_path)))
+
+    def rejected(payload):
+        raise webhook.HTTPDeliveryError('400', status=400)
+
+    def unavailable(payload):
+        raise webhook.HTTPDeliveryError('503', status=503)
+
+    with pytest.raises(webhook.HTTPDeliveryError):
+        queue.deliver('teams', {}, rejected)
+    assert not queue.spilled
+    assert queue.deliver('slack', {}, unavailable) is False
+    assert queue.spilled == {'slack': 1}
+
+
+def test_slow_replay_does_not_hold_up_other_channels(webhook, monkeypatch):
+    monkeypatch.setattr(webhook, 'SPILL_ENABLED', True)
+    with StubServer(latency=5) as hung, StubServer() as healthy:
+        enable(monkeypatch, slack=f'{hung.url}/slack', discord=f'{healthy.url}/discord')
+        webhook.get_outbound_queue().store.push('slack', {'text': 'earlier'})
+
+        # 2.5 s budget; Slack and Discord both get the "normal" 2 s share
+        result = invoke(make_alerts(2), StubContext(4))
+
+    assert healthy.by_path['discord'] == 1
+    assert 'discord' in result['notifications_sent']
+    assert result['notifications_spilled'] == ['slack']
+    assert result['outbound']['waiting'] == ['slack']
+
+
+def test_pagerduty_events_stay_independent_of_spills(webhook, monkeypatch):
+    monkeypatch.setattr(webhook, 'SPILL_ENABLED', True)
+    monkeypatch.setattr(webhook, 'SPILL_MAX_MESSAGES', 2)
+    monkeypatch.setenv('PAGERDUTY_MAX_ATTEMPTS', '1')
+    with StubServer(error_rate=0.3, seed=1) as stub:
+        enable(monkeypatch, pagerduty=f'{stub.url}/pagerduty')
+        result = invoke(make_alerts(40))
+        failures = stub.errors
+
+        # Every event is tried; the spill cap only turns spills into errors
+        assert stub.requests == 40
+        assert result['outbound']['spilled'] == {'pagerduty': 2}
+        assert f"{failures - 2} of 40 PagerDuty events failed" in result['channel_errors']['pagerduty']
+
+        stub.error_rate = 0
+        result = invoke([])
+        assert result['outbound']['replayed'] == {'pagerduty': 2}
+        assert stub.requests == 42
+
+
+# Dedup
+
+def test_dedup_retries_only_the_failing_channel(webhook, monkeypatch):
+    monkeypatch.setattr(webhook, 'DEDUP_ENABLED', True)
+    monkeypatch.setattr(webhook, 'HTTP_MAX_ATTEMPTS', 1)
+    with StubServer() as slack, StubServer(status=400) as teams:
+        enable(monkeypatch, slack=f'{slack.url}/slack', teams=f'{teams.url}/teams')
+        alerts = make_alerts(5)
+        for _ in range(3):
+            result = invoke(alerts)
+            assert result['transitions'] == {'new': 5}
+        assert slack.requests == 1
+        assert teams.requests == 3
+
+        teams.status = 202
+        assert invoke(alerts)['notifications_sent'] == ['teams']
+        assert invoke(alerts)['forwarded_alerts'] == 0
+        assert (slack.requests, teams.requests) == (1, 4)